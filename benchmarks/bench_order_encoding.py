@@ -0,0 +1,142 @@
+"""
+Micro-benchmark of the per-order cost on the create-order write path.
+
+Times the whole conversion of a validated Order request into the BSON sent
+to the database, with order.dict() (patching the dict into the saved order
+format) vs OrderDocument.from_order().to_bson(), both produce the same
+document, priced the same way. The pricing and bson.encode are also
+reported on their own, so the share of each step is visible.
+
+With --with-database it also compares the create-order product queries, one
+query per product vs the single find with $in, on a local MongoDB. It only
+runs against localhost and on its own database (BENCHMARK_DATABASE_NAME),
+dropped at the end.
+
+Run from the repository root:
+    python -m benchmarks.bench_order_encoding
+    python -m benchmarks.bench_order_encoding --with-database
+"""
+import argparse
+import os
+import timeit
+from datetime import datetime, timezone
+
+os.environ.setdefault('ECOMMERCE_DATABASE_NAME', 'ECOMMERCE_BENCHMARK')
+os.environ.setdefault('DATABASE_CLUSTER_DOMAIN', 'localhost')
+
+import bson
+
+from src.api.api_v1.endpoints.models.documents import (
+    price_order_lines,
+    OrderDocument)
+from src.api.api_v1.endpoints.models.input_models import (
+    Address,
+    Order,
+    ProductOrder)
+from src.api.api_v1.endpoints.models.model_enums import OrderStatus
+from src.database_io.database_connection import (
+    get_sync_database_connection,
+    DATABASE_CLUSTER_DOMAIN)
+
+BENCHMARK_DATABASE_NAME = 'ECOMMERCE_BENCHMARK'
+
+PRODUCTS_PER_ORDER = 10
+ADDRESS = {'street_name': 'Kakariko ranch',
+           'city': 'Hyrule',
+           'country': 'UK',
+           'post_code': 'UB345I'}
+PRODUCT_IDS = [f'benchmark-product-{index}' for index in range(PRODUCTS_PER_ORDER)]
+PRODUCTS_BY_ID = {product_id: {'product_id': product_id, 'price': 10.95}
+                  for product_id in PRODUCT_IDS}
+
+
+def build_order() -> Order:
+    """Build a validated order without going through the database validator."""
+    return Order.construct(
+        user_id='benchmark-user',
+        products=[ProductOrder(product_id=product_id, amount=1)
+                  for product_id in PRODUCT_IDS],
+        delivery_address=Address(**ADDRESS))
+
+
+def price_order_products(order: Order):
+    return price_order_lines(((product.product_id, product.amount)
+                              for product in order.products),
+                             order.delivery_address.country,
+                             PRODUCTS_BY_ID)
+
+
+def build_with_dict(order: Order) -> dict:
+    """Build the saved order from order.dict(), same document as
+    OrderDocument.to_bson()."""
+    document = order.dict()
+    document['products'], totals = price_order_products(order)
+    document['delivery_address']['country'] = order.delivery_address.country.value
+    document['status'] = OrderStatus.REQUESTING.value
+    document['created_at'] = datetime.now(timezone.utc)
+    document['totals'] = totals.to_bson()
+    return document
+
+
+def build_with_document(order: Order) -> dict:
+    return OrderDocument.from_order(order, PRODUCTS_BY_ID).to_bson()
+
+
+def get_products_one_by_one(db) -> None:
+    for product_id in PRODUCT_IDS:
+        db.products.find_one({'product_id': product_id})
+
+
+def get_products_single_query(db) -> None:
+    """Same query as create-order."""
+    list(db.products.find({'product_id': {'$in': PRODUCT_IDS}},
+                          {'_id': 0, 'product_id': 1, 'price': 1, 'discount': 1}))
+
+
+def report(name: str, statement, number: int) -> float:
+    best = min(timeit.repeat(statement, number=number, repeat=15)) / number
+    print(f'{name:<40} {best * 1e6:10.2f} us/order')
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--with-database', action='store_true',
+                        help='also benchmark the product existence queries')
+    args = parser.parse_args()
+
+    if args.with_database and DATABASE_CLUSTER_DOMAIN != 'localhost':
+        parser.error('--with-database only runs with DATABASE_CLUSTER_DOMAIN=localhost')
+
+    order = build_order()
+    assert build_with_dict(order).keys() == build_with_document(order).keys()
+    document = build_with_document(order)
+    report('pricing (both paths)', lambda: price_order_products(order), args.number)
+    report('bson.encode (both paths)', lambda: bson.encode(document), args.number)
+    before = report('order.dict() + bson.encode',
+                    lambda: bson.encode(build_with_dict(order)), args.number)
+    after = report('OrderDocument + bson.encode',
+                   lambda: bson.encode(build_with_document(order)), args.number)
+    print(f'request to BSON speed up: {before / after:.2f}x')
+
+    if args.with_database:
+        db = get_sync_database_connection()[BENCHMARK_DATABASE_NAME]
+        db.products.insert_many([{'product_id': product_id,
+                                  'price': 10.95,
+                                  'available_count': 1}
+                                 for product_id in PRODUCT_IDS])
+        db.products.create_index('product_id')
+        try:
+            number = max(args.number // 100, 10)
+            before = report('find_one per product',
+                            lambda: get_products_one_by_one(db), number)
+            after = report('single find with $in per order',
+                           lambda: get_products_single_query(db), number)
+            print(f'product queries speed up: {before / after:.2f}x')
+        finally:
+            db.client.drop_database(BENCHMARK_DATABASE_NAME)
+
+
+if __name__ == '__main__':
+    main()
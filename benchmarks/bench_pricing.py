@@ -0,0 +1,64 @@
+"""
+Pricing of many orders: Decimal single order path vs NumPy batch mode.
+
+Both arms price the same lines, with the products price and discount (the
+seed products have no discount, the benchmark gives one to every
+DISCOUNTED_EVERY product), and must get the same totals.
+
+Run from the repository root:
+    python -m benchmarks.bench_pricing --orders 100000
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('ECOMMERCE_DATABASE_NAME', 'ECOMMERCE_BENCHMARK')
+os.environ.setdefault('DATABASE_CLUSTER_DOMAIN', 'localhost')
+
+from src.database_io.seed_data import (
+    generate_orders,
+    generate_products,
+    SeedConfig)
+from src.pricing import (
+    price_order,
+    price_order_documents,
+    to_cents)
+
+DISCOUNTED_EVERY = 4
+DISCOUNT = 0.15
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=100000)
+    args = parser.parse_args()
+
+    config = SeedConfig(products=10000, users=max(1, args.orders // 4))
+    products = list(generate_products(config))
+    for product in products[::DISCOUNTED_EVERY]:
+        product['discount'] = DISCOUNT
+    products_by_id = {product['product_id']: product for product in products}
+    orders = list(generate_orders(config, products_by_id))
+    print(f'{len(orders)} orders')
+
+    started = time.perf_counter()
+    totals = [price_order(((products_by_id[line['product_id']]['price'],
+                            line['amount'],
+                            products_by_id[line['product_id']].get('discount'))
+                           for line in order['products']),
+                          order['delivery_address']['country'])
+              for order in orders]
+    single = time.perf_counter() - started
+    print(f'{"price_order (Decimal) per order":<40} {single:8.3f} s')
+
+    started = time.perf_counter()
+    batch_totals = price_order_documents(orders, products_by_id)
+    batch = time.perf_counter() - started
+    assert [to_cents(order_totals.total) for order_totals in totals] == \
+        batch_totals['total'].tolist()
+    print(f'{"price_order_documents (NumPy)":<40} {batch:8.3f} s')
+    print(f'batch speed up: {single / batch:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
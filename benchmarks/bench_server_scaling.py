@@ -0,0 +1,106 @@
+"""
+Throughput of the production server by number of workers.
+
+Starts src.server with 1, 2, 4... workers (up to the number of cores) and
+hammers a route with concurrent keep-alive connections, printing requests per
+second for each worker count.
+
+Run from the repository root:
+    python -m benchmarks.bench_server_scaling
+    python -m benchmarks.bench_server_scaling --path "/api/v1/products/available-product/<id>?count=1"
+
+Without --path it uses /health, which does not touch the database, so it
+measures the server and framework overhead only. Use a database route with a
+local MongoDB running (the server self check needs it, see --skip-self-check).
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def worker_counts(max_workers: int):
+    count = 1
+    while count < max_workers:
+        yield count
+        count *= 2
+    yield max_workers
+
+
+async def wait_until_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f'server not ready on {url}')
+
+
+async def run_load(url: str, connections: int, duration: float) -> float:
+    """Send requests from 'connections' concurrent clients for 'duration'
+    seconds, return requests per second."""
+    completed = 0
+    stop_at = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=connections,
+                          max_keepalive_connections=connections)
+
+    async with httpx.AsyncClient(limits=limits) as client:
+        async def user():
+            nonlocal completed
+            while time.monotonic() < stop_at:
+                await client.get(url)
+                completed += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*[user() for _ in range(connections)])
+        return completed / (time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--path', default='/health')
+    parser.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--skip-self-check', action='store_true')
+    args = parser.parse_args()
+
+    # lift the rate limits, we want to measure the server not the limiter.
+    env = dict(os.environ,
+               RATE_LIMIT_ENABLED='false',
+               MAX_IN_FLIGHT_REQUESTS='1000000')
+    env.setdefault('ECOMMERCE_DATABASE_NAME', 'ECOMMERCE')
+    env.setdefault('DATABASE_CLUSTER_DOMAIN', 'localhost')
+    base_rps = None
+    print(f'{"workers":>8} {"req/s":>10} {"scaling":>8}')
+    for workers in worker_counts(args.max_workers):
+        command = [sys.executable, '-m', 'src.server',
+                   '--workers', str(workers),
+                   '--bind', f'127.0.0.1:{args.port}']
+        if args.skip_self_check:
+            command.append('--skip-self-check')
+        server = subprocess.Popen(command, env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            url = f'http://127.0.0.1:{args.port}{args.path}'
+            asyncio.run(wait_until_ready(url))
+            rps = asyncio.run(run_load(url, args.connections, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+        base_rps = base_rps or rps
+        print(f'{workers:>8} {rps:>10.0f} {rps / base_rps:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Define lean internal documents used on the database write path.
+
+Request models (input_models.py) are full pydantic models, that is what we
+want at the API boundary, but once an order is validated we don't need to
+build more pydantic models or call .dict() (which walks the whole model tree
+again) just to hand a dict to pymongo. These classes use __slots__ and build
+the BSON ready dict in a single pass over the validated request model.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.api.api_v1.endpoints.models.input_models import (
+    Address,
+    Order)
+from src.api.api_v1.endpoints.models.model_enums import (
+    AllowedCountries,
+    OrderStatus)
+from src.pricing import (
+    price_order,
+    to_cents,
+    to_money,
+    to_rate,
+    OrderTotals,
+    BASIS_POINTS_PER_UNIT)
+
+
+def address_to_bson(address: Address) -> Dict:
+    """Convert an Address model into a BSON ready dict."""
+    return {'street_name': address.street_name,
+            'city': address.city,
+            'country': address.country.value,
+            'post_code': address.post_code,
+            'apartment': address.apartment}
+
+
+def price_order_lines(order_lines: Iterable[Tuple[str, int]],
+                      country: AllowedCountries,
+                      products_by_id: Dict[str, Dict]) -> Tuple[List[Dict], OrderTotals]:
+    """Price order lines with the products price and discount.
+
+    Args:
+        order_lines: (product id, amount) of each order line.
+        country: delivery country, selects the tax rate.
+        products_by_id: products of the order as saved on database (we need
+            price and the optional discount) by product id.
+
+    Returns:
+        BSON ready order lines, with unit_price_cents, discount_basis_points
+            and line_total_cents, and the order totals.
+    """
+    order_lines = list(order_lines)
+    lines = []
+    for product_id, amount in order_lines:
+        stored = products_by_id[product_id]
+        lines.append((to_money(stored['price']), amount, to_rate(stored.get('discount'))))
+    totals = price_order(lines, country)
+    return ([{'product_id': product_id,
+              'amount': amount,
+              'unit_price_cents': to_cents(unit_price),
+              'discount_basis_points': int(discount * BASIS_POINTS_PER_UNIT),
+              'line_total_cents': to_cents(line_total)}
+             for (product_id, amount), (unit_price, _, discount), line_total
+             in zip(order_lines, lines, totals.line_totals)],
+            totals)
+
+
+class OrderDocument:
+    """Order as it is saved on the orders collection.
+
+    Args:
+        user_id: id of the user that made the order.
+        products: list of {'product_id': ..., 'amount': ...} dicts, priced
+            orders lines also have unit_price_cents, discount_basis_points and
+            line_total_cents.
+        delivery_address: BSON ready address dict.
+        status: order status, new orders start as REQUESTING.
+        created_at: order creation time (UTC).
+        totals: order totals, saved with the order so reads don't compute them.
+    """
+    __slots__ = ('user_id', 'products', 'delivery_address', 'status',
+                 'created_at', 'totals')
+
+    def __init__(self,
+                 user_id: str,
+                 products: List[Dict],
+                 delivery_address: Dict,
+                 status: OrderStatus = OrderStatus.REQUESTING,
+                 created_at: datetime = None,
+                 totals: Optional[OrderTotals] = None):
+        self.user_id = user_id
+        self.products = products
+        self.delivery_address = delivery_address
+        self.status = status
+        self.created_at = created_at or datetime.now(timezone.utc)
+        self.totals = totals
+
+    @classmethod
+    def from_order(cls, order: Order, products_by_id: Dict[str, Dict]) -> 'OrderDocument':
+        """Build the priced document from an already validated Order request
+        model.
+
+        Args:
+            order: validated Order.
+            products_by_id: products of the order as saved on database (we
+                need price and the optional discount) by product id.
+        """
+        products, totals = price_order_lines(
+            ((product.product_id, product.amount) for product in order.products),
+            order.delivery_address.country,
+            products_by_id)
+        return cls(
+            user_id=order.user_id,
+            products=products,
+            delivery_address=address_to_bson(order.delivery_address),
+            totals=totals)
+
+    def to_bson(self) -> Dict:
+        """Return the dict to pass to insert_one."""
+        document = {'user_id': self.user_id,
+                    'products': self.products,
+                    'delivery_address': self.delivery_address,
+                    'status': self.status.value,
+                    'created_at': self.created_at}
+        if self.totals is not None:
+            document['totals'] = self.totals.to_bson()
+        return document
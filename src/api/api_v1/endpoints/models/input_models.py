@@ -1,6 +1,7 @@
 """
 Define rest api input pydantic models
 """
+from decimal import Decimal
 from typing import (
     List,
     Optional)
@@ -11,8 +12,8 @@ from src.api.api_v1.endpoints.models.model_enums import (
     AllowedCountries)
 from src.database_io.database_connection import (
     get_database_connection,
-    get_sync_database_connection,
     ECOMMERCE_DATABASE_NAME)
+from src.pricing import line_total
 
 
 class Address(BaseModel):
@@ -61,26 +62,6 @@ class Order(BaseModel):
     products: List[ProductOrder]
     delivery_address: Address
 
-    @validator("products", each_item=True)
-    def check_products_exists(cls, product):
-        """Check if a product exists on inventory.
-
-        Connects database and tries to find it in inventory. we use the pymongo
-            function count_documents which is better way than the one above.
-
-        Args:
-            value: this is the product id
-
-        Returns:
-            True if product exists
-            False if it NOT exists
-        """
-        client = get_sync_database_connection()
-        db = client[ECOMMERCE_DATABASE_NAME]
-        exists = db.products.count_documents({'product_id': product.product_id}) > 0
-        if not exists:
-            raise ValueError(f"Product with id = {product.product_id} does not exist")
-
 
 class User(BaseModel):
     user_id: str
@@ -95,5 +76,7 @@ class OrderProduct(BaseModel):
     price: float
     discount: Optional[float]
 
-    def total(self):
-        pass
+    def total(self) -> Decimal:
+        """Line total, price * quantity minus the discount, a Decimal amount
+        in currency units (e.g. Decimal('30.45'))"""
+        return line_total(self.price, self.quantity, self.discount)
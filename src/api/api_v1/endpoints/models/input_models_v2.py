@@ -1,9 +1,6 @@
 from pydantic import BaseModel, validator
 from enum import Enum
 from bson.objectid import ObjectId
-from src.database_io.database_connection import (
-    get_sync_database_connection,
-    ECOMMERCE_DATABASE_NAME)
 from src.api.api_v1.endpoints.models.model_enums import OrderStatus
 
 
@@ -12,11 +9,10 @@ class UpdateOrderStatus(BaseModel):
     status: OrderStatus
 
     @validator("order_id")
-    def check_order_exists(cls, value):
-        """Validate that order exists"""
-        db = get_sync_database_connection()
-        ecommerce_col = db[ECOMMERCE_DATABASE_NAME]
-        if not ecommerce_col.orders.count_documents({'_id': ObjectId(value)}) > 0:
-            raise ValueError(f"Order  with Id: {value} does not exist")
+    def check_order_id(cls, value):
+        """Validate that order id is a valid ObjectId, whether the order
+        exists is checked by the update itself (validators run on the event
+        loop, they must not query the database)."""
+        if not ObjectId.is_valid(value):
+            raise ValueError(f"Order with Id: {value} is not a valid order id")
         return value
-
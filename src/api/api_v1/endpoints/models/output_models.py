@@ -1,4 +1,4 @@
-from typing import Union, Annotated, Any, List,  Optional
+from typing import Union, Annotated, Any, Dict, List,  Optional
 from pydantic import BaseModel
 from src.api.api_v1.endpoints.models.input_models import Address
 from src.api.api_v1.endpoints.models.model_enums import OrderStatus
@@ -31,3 +31,13 @@ class Order(BaseModel):
 class UserOrders(BaseModel):
     username: str
     orders: List[Order]
+
+
+class OrderStatistics(BaseModel):
+    total: int
+    by_status: Dict[OrderStatus, int]
+
+
+class UserInfo(BaseModel):
+    user_id: str
+    orders: OrderStatistics
@@ -1,22 +1,50 @@
 """
 API Order operations
 """
+from datetime import date
+from typing import Optional
+
 from bson.objectid import ObjectId
 from fastapi import (
     APIRouter,
+    Header,
     Path,
+    Query,
     status)
 from fastapi.exceptions import HTTPException
 from fastapi.responses import JSONResponse
 
+from src.api.api_v1.endpoints.models.documents import OrderDocument
 from src.api.api_v1.endpoints.models.input_models import (
     Order)
 from src.api.api_v1.endpoints.models.input_models_v2 import UpdateOrderStatus
-from src.api.api_v1.endpoints.models.output_models import SavedOrderId
+from src.api.api_v1.endpoints.models.output_models import (
+    OrderStatistics,
+    SavedOrderId)
 from src.database_io.database_connection import (
+    database_call,
+    decode_operation_time,
+    encode_operation_time,
+    get_database,
     get_database_connection,
-    get_sync_database_connection,
+    run_in_transaction,
+    ReadPolicy,
     ECOMMERCE_DATABASE_NAME)
+from src.database_io.order_statistics import (
+    apply_stats_updates,
+    day_stats_id,
+    get_order_stats,
+    order_created_updates,
+    status_changed_updates,
+    GLOBAL_STATS_ID)
+from src.database_io.outbox import (
+    build_order_event,
+    ORDER_CREATED,
+    ORDER_STATUS_CHANGED,
+    OUTBOX_FIELD)
+from src.database_io.resilience import (
+    max_time_ms_option,
+    remaining_time_ms)
 
 router = APIRouter()
 
@@ -25,16 +53,49 @@ router = APIRouter()
 async def create_order(order: Order) -> SavedOrderId:
     """Create an order.
 
-    Validate order input data and save on mongoDB database
+    Validate order input data, price it (see pricing.py) and save on mongoDB
+        database with its totals, the order_created event is saved on the
+        order itself, on the same write, and delivered by the outbox
+        dispatcher (see outbox.py). The order and the order statistics are
+        saved on the same transaction.
 
     Args:
-        order: Pydantic Basemodel Order, we use pydantic validator functionality
-            to validate that all products on the order exist.
+        order: Pydantic Basemodel Order.
+
+    Raises:
+        HTTPException: 422 if any of the order products does not exist.
     """
     database_client = get_database_connection()
     db = database_client[ECOMMERCE_DATABASE_NAME]
-    created_order_id = await db.orders.insert_one(order.dict())
-    return SavedOrderId(order_id=str(created_order_id.inserted_id))
+    # a single query gets the prices and tells which products exist.
+    product_ids = {product.product_id for product in order.products}
+    products = await database_call(db.products.find(
+        {'product_id': {'$in': list(product_ids)}},
+        {'_id': 0, 'product_id': 1, 'price': 1, 'discount': 1},
+        max_time_ms=remaining_time_ms()).to_list(None))
+    products_by_id = {product['product_id']: product for product in products}
+    missing_ids = product_ids.difference(products_by_id)
+    if missing_ids:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"Product with id = {', '.join(sorted(missing_ids))} "
+                                   f"does not exist")
+    order_document = OrderDocument.from_order(order, products_by_id).to_bson()
+    order_document[OUTBOX_FIELD] = [build_order_event(
+        ORDER_CREATED,
+        {'user_id': order_document['user_id'],
+         'products': order_document['products'],
+         'status': order_document['status']})]
+
+    async def save_order(session):
+        created_order = await db.orders.insert_one(order_document, session=session)
+        await apply_stats_updates(db, order_created_updates(order_document), session=session)
+        return created_order
+
+    async with await database_client.start_session() as session:
+        created_order = await run_in_transaction(session,
+                                                 save_order,
+                                                 max_commit_time_ms=remaining_time_ms())
+    return SavedOrderId(order_id=str(created_order.inserted_id))
 
 
 # here you could do the same with url /update-order-status/{order_id}?status={status}
@@ -46,33 +107,111 @@ async def update_order_status(update_status: UpdateOrderStatus):
 
     Args:
         update_status: Pydantic BaseModel with the order id and the new status.
-            class checks the field order id to validate that it exists
+
+    Returns: Json response with content {"orderStatus": order['status']}, the
+        update runs on a causal consistent session, when the database returns
+        an operation time it is sent on the X-Read-After header, send it back
+        to get-order-status to read your own write from a secondary. The
+        order and the order statistics are updated on the same transaction.
+
+    Raises:
+        HTTPException: If order not found.
     """
-    database_client = get_sync_database_connection()
-    db = database_client[ECOMMERCE_DATABASE_NAME]
-    _ = db.orders.update_one({"_id": ObjectId(update_status.order_id)},
-                             {"$set": {"status": update_status.status}})
+    database_client = get_database_connection()
+    # transactions read from the primary.
+    db = get_database()
+
+    async def update_order(session):
+        # we get the order before the update to know which status to
+        # decrement on the order statistics.
+        order = await db.orders.find_one_and_update(
+            {"_id": ObjectId(update_status.order_id)},
+            {"$set": {"status": update_status.status},
+             "$push": {OUTBOX_FIELD: build_order_event(
+                 ORDER_STATUS_CHANGED,
+                 {'status': update_status.status.value})}},
+            projection={"user_id": 1, "status": 1, "created_at": 1},
+            session=session,
+            **max_time_ms_option())
+        if order is not None:
+            await apply_stats_updates(
+                db,
+                status_changed_updates(order,
+                                       order['status'],
+                                       update_status.status.value),
+                session=session)
+        return order
+
+    async with await database_client.start_session(causal_consistency=True) as session:
+        order = await run_in_transaction(session,
+                                         update_order,
+                                         max_commit_time_ms=remaining_time_ms())
+        operation_time = session.operation_time
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    headers = {}
+    if operation_time is not None:
+        headers['X-Read-After'] = encode_operation_time(operation_time)
+    return JSONResponse(content={"orderStatus": update_status.status.value},
+                        status_code=status.HTTP_200_OK,
+                        headers=headers)
 
 
 """Another option here is to return None and let the user handle it."""
 @router.get('/get-order-status/{order_id}', status_code=status.HTTP_200_OK)
 async def get_order_status(order_id: str = Path(max_length=24,
                                                 min_length=24,
-                                                title='order id')):
+                                                title='order id'),
+                           x_read_after: Optional[str] = Header(default=None)):
     """Get teh order status by providing the order id.
 
     Args:
         order_id: order id
+        x_read_after: operation time returned by update-order-status, when
+            given the read waits until the replica has that write.
 
     Returns: Json response with content {"orderStatus": order['status']}
 
     Raises:
-        HTTPException: If order not found.
+        HTTPException: If order not found or X-Read-After is not valid.
     """
-    database_client = get_database_connection()
-    db = database_client[ECOMMERCE_DATABASE_NAME]
-    order = await db.orders.find_one({"_id": ObjectId(order_id)})
+    db = get_database(ReadPolicy.ORDERS)
+    if x_read_after is None:
+        order = await database_call(db.orders.find_one(
+            {"_id": ObjectId(order_id)},
+            max_time_ms=remaining_time_ms()))
+    else:
+        try:
+            operation_time = decode_operation_time(x_read_after)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Invalid X-Read-After header")
+        database_client = get_database_connection()
+        async with await database_client.start_session(causal_consistency=True) as session:
+            session.advance_operation_time(operation_time)
+            order = await database_call(db.orders.find_one(
+                {"_id": ObjectId(order_id)},
+                session=session,
+                max_time_ms=remaining_time_ms()))
     if order is None:
         raise HTTPException(status_code=404, detail="Order not found")
     return JSONResponse(content={"orderStatus": order['status']},
                         status_code=status.HTTP_200_OK)
+
+
+@router.get('/order-stats', status_code=status.HTTP_200_OK)
+async def get_orders_statistics(
+        day: Optional[date] = Query(default=None,
+                                    description='day the orders were created')
+) -> OrderStatistics:
+    """Get the orders count, total and by status.
+
+    Counts are read from the pre-aggregated order statistics, so this is a
+        single document read no matter how many orders there are.
+
+    Args:
+        day: if given only count the orders created that day.
+    """
+    db = get_database(ReadPolicy.ORDERS)
+    stats_id = GLOBAL_STATS_ID if day is None else day_stats_id(day)
+    return OrderStatistics(**await database_call(get_order_stats(db, stats_id)))
@@ -1,6 +1,4 @@
 """Product endpoints"""
-from typing import Annotated, Union
-
 from fastapi import (
     APIRouter,
     Query,
@@ -9,37 +7,26 @@ from fastapi import (
     status, Depends)
 from fastapi.responses import JSONResponse
 
+from src.api.auth import get_current_user, User
 from src.api.api_v1.endpoints.models.output_models import AvailableProduct
+from src.cache import TTLCache
 from src.database_io.database_connection import (
+    database_call,
+    get_database,
     get_database_connection,
+    ReadPolicy,
     ECOMMERCE_DATABASE_NAME)
-from fastapi.security import OAuth2PasswordBearer
-from pydantic import BaseModel
+from src.database_io.resilience import (
+    remaining_time_ms,
+    DatabaseUnavailable,
+    DeadlineExceeded)
 
 
 router = APIRouter()
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
-
-
-class User(BaseModel):
-    username: str
-    email: Union[str, None] = None
-    full_name: Union[str, None] = None
-    disabled: Union[bool, None] = None
-
-
-def fake_decode_token(token):
-    return User(
-        username=token + "fakedecoded",
-        email="john@example.com",
-        full_name="John Doe"
-    )
-
-
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
-    user = fake_decode_token(token)
-    return user
+# Last known available count of each product, only used to answer
+# available-product while the database is unavailable.
+AVAILABILITY_CACHE = TTLCache(maxsize=100000, ttl=300)
 
 
 @router.get("/users/me")
@@ -63,20 +50,28 @@ async def available_product(product_id: str = Path(min_length=5,
     """Ask if there are enough items of specific product on inventory.
 
     Connect to database, get the product and verify if we have enough items
-        of that product on inventory.
+        of that product on inventory. When the database is unavailable we answer
+        with the last known available count of the product if we have it.
     Args:
         product_id: Product id
         count: amount that we want to know if there are enough on inventory.
     """
-    database_client = get_database_connection()
-    db = database_client[ECOMMERCE_DATABASE_NAME]
-    product = await db.products.find_one(
-        {'product_id': product_id}
-    )
+    try:
+        db = get_database(ReadPolicy.CATALOGUE)
+        product = await database_call(db.products.find_one(
+            {'product_id': product_id},
+            max_time_ms=remaining_time_ms()
+        ))
+    except (DatabaseUnavailable, DeadlineExceeded):
+        available_count = AVAILABILITY_CACHE.get(product_id)
+        if available_count is None:
+            raise
+        return AvailableProduct(is_available=available_count >= count)
     if product is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Product with product id = {product_id} "
                                    f"does not exist")
+    AVAILABILITY_CACHE.set(product_id, product['available_count'])
     product_is_available = product['available_count'] >= count
     return AvailableProduct(is_available=product_is_available)
 
@@ -97,9 +92,10 @@ async def discount_product_count(product_id: str = Path(min_length=5,
     """
     database_client = get_database_connection()
     db = database_client[ECOMMERCE_DATABASE_NAME]
-    product = await db.products.find_one(
-        {'product_id': product_id}
-    )
+    product = await database_call(db.products.find_one(
+        {'product_id': product_id},
+        max_time_ms=remaining_time_ms()
+    ))
     if product is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Product with product id = {product_id} "
@@ -110,10 +106,11 @@ async def discount_product_count(product_id: str = Path(min_length=5,
               f"products = { product['available_count']}"
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail=msg)
-    await db.products.update_one(
+    await database_call(db.products.update_one(
         {'product_id': product_id},
         {'$set':
              {'available_count': new_available_count}
         }
-    )
+    ))
+    AVAILABILITY_CACHE.set(product_id, new_available_count)
     return JSONResponse(content={"message": "Updated correctly"})
\ No newline at end of file
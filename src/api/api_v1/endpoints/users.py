@@ -2,9 +2,27 @@ from datetime import datetime
 from typing import Annotated, Union, List
 from fastapi import (
     APIRouter,
+    Depends,
+    HTTPException,
     Query,
-    Path)
+    Path,
+    status)
+from src.api.auth import (
+    get_current_user,
+    oauth2_scheme,
+    revoke_token,
+    User)
 from src.api.api_v1.endpoints.models.input_models import Order
+from src.api.api_v1.endpoints.models.output_models import (
+    OrderStatistics,
+    UserInfo)
+from src.database_io.database_connection import (
+    database_call,
+    get_database,
+    ReadPolicy)
+from src.database_io.order_statistics import (
+    get_order_stats,
+    user_stats_id)
 from fastapi import APIRouter
 
 router = APIRouter()
@@ -20,5 +38,25 @@ async def get_users_orders(
 
 
 @router.get("/user-info")
-async def get_user():
-    pass
\ No newline at end of file
+async def get_user(current_user: User = Depends(get_current_user)) -> UserInfo:
+    """Get the info of the request bearer token user, with the user orders
+    count, total and by status.
+
+    Raises:
+        HTTPException: 401 if the token is not valid, 404 if the user has no
+            user id (users without one have no orders).
+    """
+    if current_user.user_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="User has no user id")
+    db = get_database(ReadPolicy.ORDERS)
+    orders_stats = await database_call(get_order_stats(db, user_stats_id(current_user.user_id)))
+    return UserInfo(user_id=current_user.user_id, orders=OrderStatistics(**orders_stats))
+
+
+@router.post("/revoke-token", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_current_token(token: str = Depends(oauth2_scheme),
+                               current_user: User = Depends(get_current_user)):
+    """Revoke the request bearer token (log out), it can't be used again
+    even before it expires."""
+    await revoke_token(token)
@@ -0,0 +1,315 @@
+"""
+JWT authentication.
+
+get_current_user is the FastAPI dependency for authenticated endpoints, to
+keep it cheap on every request:
+    - the signing keys are cached (the secret, or the JWKS keys fetched on a
+      thread and refreshed every JWT_JWKS_CACHE_SECONDS).
+    - decoded claims are cached by token until the cache TTL or the token
+      expiry, whichever comes first, so a known token is a dict lookup
+      instead of a signature verification.
+    - users are cached by username for AUTH_CACHE_TTL_SECONDS.
+
+Revoked tokens are saved on the revoked_tokens collection (with a TTL index
+so they are deleted when the token expires anyway). The process revoking a
+token rejects it straight away, every process looks each token up on
+revoked_tokens at most once every AUTH_REVOCATION_CHECK_SECONDS, so other
+server processes reject it at most that many seconds later.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Union
+
+import jwt
+from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import OAuth2PasswordBearer
+from pydantic import BaseModel
+
+from src.cache import TTLCache
+from src.database_io.database_connection import (
+    database_call,
+    get_database)
+from src.database_io.resilience import remaining_time_ms
+
+JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
+JWT_JWKS_URL = os.environ.get('JWT_JWKS_URL')
+JWT_JWKS_CACHE_SECONDS = int(os.environ.get('JWT_JWKS_CACHE_SECONDS', 300))
+JWT_JWKS_MIN_REFRESH_SECONDS = int(os.environ.get('JWT_JWKS_MIN_REFRESH_SECONDS', 30))
+JWT_JWKS_TIMEOUT_SECONDS = int(os.environ.get('JWT_JWKS_TIMEOUT_SECONDS', 5))
+JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'RS256' if JWT_JWKS_URL else 'HS256')
+JWT_ACCESS_TOKEN_MINUTES = int(os.environ.get('JWT_ACCESS_TOKEN_MINUTES', 30))
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get('AUTH_CACHE_TTL_SECONDS', 60))
+AUTH_CACHE_MAX_SIZE = int(os.environ.get('AUTH_CACHE_MAX_SIZE', 10000))
+AUTH_REVOCATION_CHECK_SECONDS = float(os.environ.get('AUTH_REVOCATION_CHECK_SECONDS', 5))
+REVOKED_TOKENS_COLLECTION = 'revoked_tokens'
+
+logger = logging.getLogger(__name__)
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
+
+
+class User(BaseModel):
+    username: str
+    # id of the user on the orders (user_id field), see users/user-info.
+    user_id: Union[str, None] = None
+    email: Union[str, None] = None
+    full_name: Union[str, None] = None
+    disabled: Union[bool, None] = None
+
+
+class KeyProvider(ABC):
+    """Get the key to verify a token signature."""
+
+    @abstractmethod
+    async def get_key(self, token: str):
+        """Get the key of a token.
+
+        Raises:
+            jwt.PyJWTError: If there is no key for the token.
+        """
+        pass
+
+
+class SecretKeyProvider(KeyProvider):
+    """Shared secret, for HS256 tokens."""
+
+    def __init__(self, secret: str):
+        self.secret = secret
+
+    async def get_key(self, token: str):
+        return self.secret
+
+
+class JWKSKeyProvider(KeyProvider):
+    """Public keys from a JWKS url, chosen by the token 'kid' header.
+
+    The key set is fetched (a blocking http call, run on the threadpool) when
+    it is older than 'lifespan' seconds or a token has an unknown kid, at most
+    once every min_refresh_interval seconds, so tokens with made up kids
+    can't make us fetch the key set on every request.
+
+    Args:
+        url: JWKS url.
+        lifespan: seconds the key set is used before fetching it again.
+        min_refresh_interval: min seconds between two fetches.
+        timeout: fetch timeout in seconds.
+    """
+
+    def __init__(self,
+                 url: str,
+                 lifespan: float = JWT_JWKS_CACHE_SECONDS,
+                 min_refresh_interval: float = JWT_JWKS_MIN_REFRESH_SECONDS,
+                 timeout: float = JWT_JWKS_TIMEOUT_SECONDS):
+        self.client = jwt.PyJWKClient(url, cache_jwk_set=False, timeout=timeout)
+        self.lifespan = lifespan
+        self.min_refresh_interval = min_refresh_interval
+        self.keys: Dict[str, jwt.PyJWK] = {}
+        self.fetched_at = -float('inf')
+        self.refreshed_at = -float('inf')
+        self.lock = threading.Lock()
+
+    async def get_key(self, token: str):
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = self.keys.get(kid)
+        if key is None or time.monotonic() - self.fetched_at >= self.lifespan:
+            key = await run_in_threadpool(self.refresh, kid)
+        return key.key
+
+    def refresh(self, kid: Optional[str]) -> jwt.PyJWK:
+        """Fetch the key set if it is stale or has no 'kid' key, unless it
+        was fetched less than min_refresh_interval seconds ago."""
+        with self.lock:
+            key = self.keys.get(kid)
+            now = time.monotonic()
+            stale = now - self.fetched_at >= self.lifespan
+            if (key is None or stale) and now - self.refreshed_at >= self.min_refresh_interval:
+                self.refreshed_at = now
+                try:
+                    self.keys = {signing_key.key_id: signing_key
+                                 for signing_key in self.client.get_signing_keys()}
+                    self.fetched_at = now
+                except jwt.PyJWTError:
+                    if key is None:
+                        raise
+                    # keep using the stale key until the JWKS url is back.
+                    logger.exception('JWKS refresh failed, using the cached keys')
+                key = self.keys.get(kid, key)
+        if key is None:
+            raise jwt.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+
+def seconds_to_expiry(claims: Dict) -> float:
+    return claims['exp'] - datetime.now(timezone.utc).timestamp()
+
+
+class TokenVerifier:
+    """Verify tokens, caching the claims of the tokens already verified.
+
+    Args:
+        key_provider: KeyProvider
+        algorithm: token signature algorithm.
+        cache: TTLCache for the decoded claims by token.
+    """
+
+    def __init__(self, key_provider: KeyProvider, algorithm: str, cache: TTLCache):
+        self.key_provider = key_provider
+        self.algorithm = algorithm
+        self.cache = cache
+
+    async def verify(self, token: str) -> Dict:
+        """Get the token claims.
+
+        Raises:
+            jwt.PyJWTError: If the token is not valid or expired, or there is
+                no key to verify it.
+        """
+        claims = self.cache.get(token)
+        if claims is not None:
+            return claims
+        claims = jwt.decode(token,
+                            await self.key_provider.get_key(token),
+                            algorithms=[self.algorithm],
+                            options={'require': ['exp', 'sub', 'jti']})
+        ttl = min(self.cache.ttl, seconds_to_expiry(claims))
+        self.cache.set(token, claims, ttl=ttl)
+        return claims
+
+    def forget(self, token: str):
+        self.cache.delete(token)
+
+
+def get_key_provider() -> KeyProvider:
+    if JWT_JWKS_URL:
+        return JWKSKeyProvider(JWT_JWKS_URL)
+    if not JWT_SECRET_KEY:
+        raise RuntimeError('Set JWT_SECRET_KEY or JWT_JWKS_URL to authenticate users')
+    return SecretKeyProvider(JWT_SECRET_KEY)
+
+
+TOKEN_VERIFIER: Optional[TokenVerifier] = None
+USER_CACHE = TTLCache(maxsize=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+# jti of the tokens known to be revoked, until they expire.
+REVOKED_TOKEN_IDS = TTLCache(maxsize=AUTH_CACHE_MAX_SIZE,
+                             ttl=JWT_ACCESS_TOKEN_MINUTES * 60)
+# jti of the tokens found not revoked on the last revoked_tokens lookup.
+NOT_REVOKED_TOKEN_IDS = TTLCache(maxsize=AUTH_CACHE_MAX_SIZE,
+                                 ttl=AUTH_REVOCATION_CHECK_SECONDS)
+
+
+def get_token_verifier() -> TokenVerifier:
+    global TOKEN_VERIFIER
+    if TOKEN_VERIFIER is None:
+        TOKEN_VERIFIER = TokenVerifier(
+            get_key_provider(),
+            JWT_ALGORITHM,
+            TTLCache(maxsize=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL_SECONDS))
+    return TOKEN_VERIFIER
+
+
+def create_access_token(username: str,
+                        expires_in: timedelta = timedelta(minutes=JWT_ACCESS_TOKEN_MINUTES)) -> str:
+    """Create an HS256 access token signed with JWT_SECRET_KEY."""
+    now = datetime.now(timezone.utc)
+    claims = {'sub': username,
+              'jti': uuid.uuid4().hex,
+              'iat': now,
+              'exp': now + expires_in}
+    return jwt.encode(claims, JWT_SECRET_KEY, algorithm='HS256')
+
+
+def credentials_exception(detail: str = 'Could not validate credentials') -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                         detail=detail,
+                         headers={'WWW-Authenticate': 'Bearer'})
+
+
+async def is_token_revoked(claims: Dict) -> bool:
+    """Check if the token was revoked, looking it up on the revoked_tokens
+    collection at most once every AUTH_REVOCATION_CHECK_SECONDS."""
+    jti = claims['jti']
+    if REVOKED_TOKEN_IDS.get(jti) is not None:
+        return True
+    if NOT_REVOKED_TOKEN_IDS.get(jti) is not None:
+        return False
+    db = get_database()
+    revoked = await database_call(db[REVOKED_TOKENS_COLLECTION].find_one(
+        {'_id': jti},
+        {'_id': 1},
+        max_time_ms=remaining_time_ms()))
+    if revoked is None:
+        NOT_REVOKED_TOKEN_IDS.set(jti, True)
+        return False
+    REVOKED_TOKEN_IDS.set(jti, True, ttl=seconds_to_expiry(claims))
+    return True
+
+
+async def load_user(username: str) -> Optional[User]:
+    user = USER_CACHE.get(username)
+    if user is not None:
+        return user
+    db = get_database()
+    user_data = await database_call(db.users.find_one(
+        {'username': username},
+        {'_id': 0, 'username': 1, 'user_id': 1, 'email': 1, 'full_name': 1, 'disabled': 1},
+        max_time_ms=remaining_time_ms()))
+    if user_data is None:
+        return None
+    user = User(**user_data)
+    USER_CACHE.set(username, user)
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    """Get the user of the request bearer token.
+
+    Raises:
+        HTTPException: 401 if the token is invalid, expired or revoked, or the
+            user does not exist or is disabled.
+    """
+    verifier = get_token_verifier()
+    try:
+        claims = await verifier.verify(token)
+    except jwt.PyJWTError:
+        raise credentials_exception()
+    if await is_token_revoked(claims):
+        verifier.forget(token)
+        raise credentials_exception('Token revoked')
+    user = await load_user(claims['sub'])
+    if user is None or user.disabled:
+        raise credentials_exception()
+    return user
+
+
+async def revoke_token(token: str):
+    """Revoke a token, it can't be used any more even if not expired.
+
+    Raises:
+        HTTPException: 401 if the token is not valid.
+    """
+    verifier = get_token_verifier()
+    try:
+        claims = await verifier.verify(token)
+    except jwt.PyJWTError:
+        raise credentials_exception()
+    expires_at = datetime.fromtimestamp(claims['exp'], timezone.utc)
+    db = get_database()
+    await database_call(db[REVOKED_TOKENS_COLLECTION].update_one(
+        {'_id': claims['jti']},
+        {'$set': {'expires_at': expires_at}},
+        upsert=True))
+    REVOKED_TOKEN_IDS.set(claims['jti'], True, ttl=seconds_to_expiry(claims))
+    NOT_REVOKED_TOKEN_IDS.delete(claims['jti'])
+    verifier.forget(token)
+
+
+def invalidate_user(username: str):
+    """Drop a user from the cache, call it when the user is updated (e.g.
+    disabled) so the change applies on this process straight away."""
+    USER_CACHE.delete(username)
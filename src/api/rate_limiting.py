@@ -0,0 +1,194 @@
+"""
+Rate limiting and admission control middlewares.
+
+RateLimitMiddleware applies a token bucket per client and route, the bucket
+state lives on a BucketStore, by default in process memory but it can be
+replaced by a shared store (e.g. Redis) implementing the same interface.
+
+ConcurrencyLimitMiddleware caps the number of requests in flight on the
+process so we shed load with a 503 before the MongoDB pool queue grows.
+
+Both are plain ASGI middlewares (no BaseHTTPMiddleware) so they only add a
+dict lookup and some arithmetic per request. The load balancer health check
+(EXEMPT_PATHS) skips both, a busy instance is still a healthy one.
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import AbstractSet, Dict, Optional, Tuple
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_PER_SECOND = float(os.environ.get('RATE_LIMIT_PER_SECOND', 50))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 100))
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', 200))
+# Comma separated addresses of our proxies/load balancers, X-Forwarded-For is
+# only trusted on requests coming from them.
+RATE_LIMIT_TRUSTED_PROXIES = frozenset(
+    address.strip()
+    for address in os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '').split(',')
+    if address.strip())
+# Paths never limited, the load balancer would take busy instances out.
+EXEMPT_PATHS = frozenset({'/health'})
+
+
+class RateLimit:
+    """Token bucket configuration.
+
+    Args:
+        rate: tokens added to the bucket per second.
+        burst: bucket capacity, max requests allowed at once.
+    """
+    __slots__ = ('rate', 'burst')
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+
+DEFAULT_RATE_LIMIT = RateLimit(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+# The routes that go to the database on every call get their own limits.
+ROUTE_RATE_LIMITS = {
+    '/api/v1/products/available-product': RateLimit(100, 200),
+    '/api/v1/orders/create-order': RateLimit(10, 20),
+}
+
+
+class BucketStore(ABC):
+    """Where the token buckets state is kept."""
+
+    @abstractmethod
+    def consume(self, key: str, limit: RateLimit, now: float) -> float:
+        """Try to take one token from the bucket 'key'.
+
+        Returns:
+            0 if the token was taken, otherwise the seconds to wait until
+                there is a token available.
+        """
+        pass
+
+
+class InMemoryBucketStore(BucketStore):
+    """Keep the buckets on an LRU dict in process memory.
+
+    Each bucket is a [tokens, last_update] list. There are at most max_buckets
+    buckets, a new bucket drops the least recently used one, which is
+    recreated full if that client comes back.
+    """
+
+    def __init__(self, max_buckets: int = 100000):
+        self.max_buckets = max_buckets
+        self.buckets: OrderedDict = OrderedDict()
+
+    def consume(self, key: str, limit: RateLimit, now: float) -> float:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                self.buckets.popitem(last=False)
+            self.buckets[key] = [limit.burst - 1, now]
+            return 0
+        self.buckets.move_to_end(key)
+        tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0
+        bucket[0] = tokens
+        return (1 - tokens) / limit.rate
+
+
+def get_client_id(scope, trusted_proxies: AbstractSet[str] = RATE_LIMIT_TRUSTED_PROXIES) -> str:
+    """Get the client id, the connection address.
+
+    When the connection comes from one of our proxies the client is on
+    X-Forwarded-For, every proxy appends the address it got the request from,
+    so the client is the last address not added by one of our proxies (the
+    addresses before it are sent by the client and can't be trusted).
+
+    Args:
+        scope: ASGI scope.
+        trusted_proxies: addresses of our proxies/load balancers.
+    """
+    client = scope.get('client')
+    peer = client[0] if client else 'unknown'
+    if peer not in trusted_proxies:
+        return peer
+    forwarded_for = [value.decode('latin-1') for name, value in scope['headers']
+                     if name == b'x-forwarded-for']
+    addresses = [address.strip() for address in ','.join(forwarded_for).split(',')
+                 if address.strip()]
+    for address in reversed(addresses):
+        if address not in trusted_proxies:
+            return address
+    return addresses[0] if addresses else peer
+
+
+class RateLimitMiddleware:
+    """Reject with 429 the requests of a client over its route rate limit."""
+
+    def __init__(self,
+                 app,
+                 store: Optional[BucketStore] = None,
+                 default_limit: RateLimit = DEFAULT_RATE_LIMIT,
+                 route_limits: Optional[Dict[str, RateLimit]] = None,
+                 trusted_proxies: AbstractSet[str] = RATE_LIMIT_TRUSTED_PROXIES,
+                 exempt_paths: AbstractSet[str] = EXEMPT_PATHS):
+        self.app = app
+        self.store = store or InMemoryBucketStore()
+        self.default_limit = default_limit
+        self.trusted_proxies = frozenset(trusted_proxies)
+        self.exempt_paths = frozenset(exempt_paths)
+        self.route_limits: Tuple[Tuple[str, RateLimit], ...] = tuple(
+            (route_limits if route_limits is not None else ROUTE_RATE_LIMITS).items())
+
+    def get_route_limit(self, path: str) -> Tuple[str, RateLimit]:
+        for route, limit in self.route_limits:
+            if path.startswith(route):
+                return route, limit
+        return '*', self.default_limit
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.exempt_paths:
+            return await self.app(scope, receive, send)
+        route, limit = self.get_route_limit(scope['path'])
+        key = f'{get_client_id(scope, self.trusted_proxies)}|{route}'
+        retry_after = self.store.consume(key, limit, time.monotonic())
+        if retry_after:
+            response = JSONResponse(
+                content={'detail': 'Too many requests'},
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(max(1, round(retry_after)))})
+            return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+
+class ConcurrencyLimitMiddleware:
+    """Reject with 503 new requests when there are max_in_flight requests
+    being processed already."""
+
+    def __init__(self,
+                 app,
+                 max_in_flight: int = MAX_IN_FLIGHT_REQUESTS,
+                 exempt_paths: AbstractSet[str] = EXEMPT_PATHS):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.exempt_paths = frozenset(exempt_paths)
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.exempt_paths:
+            return await self.app(scope, receive, send)
+        if self.in_flight >= self.max_in_flight:
+            response = JSONResponse(
+                content={'detail': 'Server busy, try again later'},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'})
+            return await response(scope, receive, send)
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,30 @@
+"""
+Request deadline middleware.
+"""
+from src.database_io.resilience import (
+    reset_request_admissions,
+    reset_request_deadline,
+    set_request_deadline,
+    start_request_admissions,
+    REQUEST_TIMEOUT_SECONDS)
+
+
+class RequestDeadlineMiddleware:
+    """Set the request deadline when the request arrives, the database calls
+    done while handling the request use the time left (see resilience.py).
+    It also scopes the circuit breaker checks to the request."""
+
+    def __init__(self, app, timeout: float = REQUEST_TIMEOUT_SECONDS):
+        self.app = app
+        self.timeout = timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        token = set_request_deadline(self.timeout)
+        admissions_token = start_request_admissions()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_request_admissions(admissions_token)
+            reset_request_deadline(token)
@@ -1,15 +1,70 @@
+import logging
 import os
 from abc import ABC, abstractmethod
+from enum import Enum
 import pymongo
 import urllib
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson.timestamp import Timestamp
 from boto3 import Session
 from botocore.credentials import ReadOnlyCredentials
+from pymongo.errors import OperationFailure
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from src.database_io.resilience import (
+    CircuitBreaker,
+    DatabaseUnavailable,
+    REQUEST_TIMEOUT_SECONDS)
 
 MONGO_CONNECTION = None
 SYNC_MONGO_CONNECTION = None
 MONGO_CONNECTION_PORT = 27017
 ECOMMERCE_DATABASE_NAME = os.environ['ECOMMERCE_DATABASE_NAME']
 DATABASE_CLUSTER_DOMAIN = os.environ['DATABASE_CLUSTER_DOMAIN']
+# MongoDB does not accept a max staleness lower than 90 seconds.
+DATABASE_MAX_STALENESS_SECONDS = int(os.environ.get('DATABASE_MAX_STALENESS_SECONDS', 90))
+
+# Client timeouts, maxTimeMS only bounds the work on the server, these bound
+# waiting for a server to be selected, connected and to answer, so a slow or
+# unreachable server can't hold a request (or a motor executor thread) for
+# longer than a request may take.
+DATABASE_CLIENT_OPTIONS = {
+    'serverSelectionTimeoutMS': int(os.environ.get('DATABASE_SERVER_SELECTION_TIMEOUT_MS', 2000)),
+    'connectTimeoutMS': int(os.environ.get('DATABASE_CONNECT_TIMEOUT_MS', 2000)),
+    'socketTimeoutMS': int(os.environ.get('DATABASE_SOCKET_TIMEOUT_MS',
+                                          REQUEST_TIMEOUT_SECONDS * 1000)),
+}
+
+# Standalone servers (e.g. a local mongod) reject transactions with this error
+# code, TRANSACTIONS_SUPPORTED is set to False the first time it happens.
+ILLEGAL_OPERATION_ERROR_CODE = 20
+TRANSACTIONS_SUPPORTED = True
+
+logger = logging.getLogger(__name__)
+
+DATABASE_CIRCUIT_BREAKER = CircuitBreaker(
+    failure_threshold=int(os.environ.get('DATABASE_BREAKER_FAILURE_THRESHOLD', 5)),
+    reset_timeout=float(os.environ.get('DATABASE_BREAKER_RESET_TIMEOUT', 10)))
+
+
+class ReadPolicy(str, Enum):
+    """Where each kind of read is sent.
+
+    PRIMARY: reads that must see the latest data, e.g. read before a write.
+    CATALOGUE: products & availability, can be served by a secondary with at
+        most DATABASE_MAX_STALENESS_SECONDS of lag.
+    ORDERS: order reads, same as CATALOGUE, callers that need to read their
+        own writes use a causal consistent session (see decode_operation_time).
+    """
+    PRIMARY = 'PRIMARY'
+    CATALOGUE = 'CATALOGUE'
+    ORDERS = 'ORDERS'
+
+
+READ_PREFERENCES = {
+    ReadPolicy.PRIMARY: Primary(),
+    ReadPolicy.CATALOGUE: SecondaryPreferred(max_staleness=DATABASE_MAX_STALENESS_SECONDS),
+    ReadPolicy.ORDERS: SecondaryPreferred(max_staleness=DATABASE_MAX_STALENESS_SECONDS),
+}
 
 
 class MongoDbConnection(ABC):
@@ -52,9 +107,15 @@ class MongoDbConnectByAwsRoleCredentials(MongoDbConnection):
                             f"&w=majority&authMechanismProperties=AWS_SESSION_TOKEN:{session_token}"
 
 
-def connect_to_mongo() -> pymongo.mongo_client:
+def connect_to_mongo(client_class=pymongo.MongoClient, **client_options) -> pymongo.mongo_client:
     """Connect to mongodb with one of the given options.
 
+    Args:
+        client_class: pymongo.MongoClient for the sync connection or
+            AsyncIOMotorClient for the async one.
+        client_options: client keyword arguments, they override
+            DATABASE_CLIENT_OPTIONS (e.g. socketTimeoutMS=None for batch jobs).
+
     Returns:
         pymongo client
     """
@@ -62,19 +123,120 @@ def connect_to_mongo() -> pymongo.mongo_client:
         connection_string = MongoDbLocalConnection().get_connection_string()
     else:
         connection_string = MongoDbConnectByAwsRoleCredentials().get_connection_string()
-    client = pymongo.MongoClient(connection_string)
+    client = client_class(connection_string, **{**DATABASE_CLIENT_OPTIONS, **client_options})
     return client
 
 
-def get_database_connection():
+def check_circuit_breaker():
+    """Fail fast when the database circuit breaker is open, the breaker is
+    checked once per request (see CircuitBreaker.allow_current_request).
+
+    Raises:
+        DatabaseUnavailable: If the circuit breaker is open.
+    """
+    if not DATABASE_CIRCUIT_BREAKER.allow_current_request():
+        raise DatabaseUnavailable()
+
+
+async def database_call(awaitable):
+    """Await a motor call within the request deadline, recording the result
+    on the database circuit breaker."""
+    return await DATABASE_CIRCUIT_BREAKER.call(awaitable)
+
+
+async def run_in_transaction(session, callback, **transaction_options):
+    """Run callback(session) on a transaction of the session, within the
+    request deadline.
+
+    Standalone servers don't support transactions, there the callback runs on
+        the session without a transaction (the writes are not atomic, fine
+        for local development, deployments run on a replica set). The server
+        rejects the first write of the transaction, so nothing was written
+        when we run the callback again.
+
+    Args:
+        session: motor client session.
+        callback: async function of the session doing the writes.
+        transaction_options: with_transaction keyword arguments.
+    """
+    global TRANSACTIONS_SUPPORTED
+    if TRANSACTIONS_SUPPORTED:
+        try:
+            return await database_call(session.with_transaction(callback, **transaction_options))
+        except OperationFailure as error:
+            if error.code != ILLEGAL_OPERATION_ERROR_CODE:
+                raise
+            TRANSACTIONS_SUPPORTED = False
+            logger.warning('The database does not support transactions, '
+                           'writing without transactions: %s', error)
+    return await database_call(callback(session))
+
+
+def get_database_client():
+    """Get the async client without checking the circuit breaker.
+
+    Only for background jobs with their own retries (e.g. the outbox
+        dispatcher), they must not take the half open trial call of the API
+        requests nor record their results on the breaker.
+    """
     global MONGO_CONNECTION
     if MONGO_CONNECTION is None:
-        MONGO_CONNECTION = connect_to_mongo()
+        MONGO_CONNECTION = connect_to_mongo(AsyncIOMotorClient)
     return MONGO_CONNECTION
 
 
+def get_database_connection():
+    check_circuit_breaker()
+    return get_database_client()
+
+
 def get_sync_database_connection():
     global SYNC_MONGO_CONNECTION
+    check_circuit_breaker()
     if SYNC_MONGO_CONNECTION is None:
         SYNC_MONGO_CONNECTION = connect_to_mongo()
-    return SYNC_MONGO_CONNECTION
\ No newline at end of file
+    return SYNC_MONGO_CONNECTION
+
+
+def reset_database_connections():
+    """Forget the current clients so the next call creates new ones.
+
+    MongoClient is not fork safe, server workers call this after fork so each
+        worker creates its own clients (and connection pools).
+    """
+    global MONGO_CONNECTION, SYNC_MONGO_CONNECTION
+    MONGO_CONNECTION = None
+    SYNC_MONGO_CONNECTION = None
+
+
+def get_database(read_policy: ReadPolicy = ReadPolicy.PRIMARY):
+    """Get the ecommerce database with the read preference of the read policy.
+
+    Args:
+        read_policy: ReadPolicy to apply to the reads done on the database.
+    """
+    return get_database_connection().get_database(
+        ECOMMERCE_DATABASE_NAME,
+        read_preference=READ_PREFERENCES[read_policy])
+
+
+def get_background_database():
+    """Get the ecommerce database (primary reads) for background jobs, see
+    get_database_client."""
+    return get_database_client()[ECOMMERCE_DATABASE_NAME]
+
+
+def encode_operation_time(operation_time: Timestamp) -> str:
+    """Encode a session operation time to return it to the client, format is
+    '<seconds>.<increment>'."""
+    return f'{operation_time.time}.{operation_time.inc}'
+
+
+def decode_operation_time(token: str) -> Timestamp:
+    """Decode an operation time encoded with encode_operation_time.
+
+    Raises:
+        ValueError: If the token is not valid.
+    """
+    seconds, increment = token.split('.')
+    return Timestamp(int(seconds), int(increment))
@@ -0,0 +1,48 @@
+"""
+Database indexes and start up checks.
+"""
+from typing import Dict, List
+
+import pymongo
+from pymongo import IndexModel
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    'products': [
+        IndexModel([('product_id', pymongo.ASCENDING)], unique=True),
+    ],
+    'orders': [
+        IndexModel([('user_id', pymongo.ASCENDING),
+                    ('created_at', pymongo.DESCENDING)]),
+        # only orders with pending events are on this index, see outbox.py
+        IndexModel([('pending_events.event_id', pymongo.ASCENDING)], sparse=True),
+    ],
+    'users': [
+        IndexModel([('username', pymongo.ASCENDING)], unique=True),
+    ],
+    # _id is the token jti, documents are deleted once the token has expired.
+    'revoked_tokens': [
+        IndexModel([('expires_at', pymongo.ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+
+def ensure_indexes(db) -> None:
+    """Create the indexes that don't exist yet (create_indexes is a no-op for
+    existing indexes with the same spec)."""
+    for collection_name, indexes in INDEXES.items():
+        db[collection_name].create_indexes(indexes)
+
+
+def check_database(client, database_name: str) -> None:
+    """Check the database is reachable and has the expected indexes.
+
+    Args:
+        client: pymongo (sync) client.
+        database_name: ecommerce database name.
+
+    Raises:
+        pymongo.errors.PyMongoError: If the database is not reachable or the
+            indexes can not be created.
+    """
+    client.admin.command('ping')
+    ensure_indexes(client[database_name])
@@ -0,0 +1,175 @@
+"""
+Pre-aggregated order statistics.
+
+Instead of running aggregation pipelines over the orders collection we keep
+summary documents on the order_stats collection that are incremented every
+time an order is created or changes status:
+
+    {'_id': 'global', 'total': 10, 'by_status': {'REQUESTING': 4, ...}}
+    {'_id': 'user:<user_id>', ...}
+    {'_id': 'day:<YYYY-MM-DD>', ...}  (day the order was created)
+
+Reading the stats is a single find_one by _id.
+
+The updates are applied on the same transaction as the order write (see
+orders.py), so the counts can't drift from the orders collection when one of
+the writes fails. Transactions need a replica set, like the secondary reads
+and causal sessions on database_connection.py; a single node replica set
+(mongod --replSet rs0, then rs.initiate()) is enough for local development.
+On a standalone mongod the writes run without a transaction (see
+run_in_transaction).
+
+Orders saved before the statistics were kept are not counted, the counts
+would go negative when they change status. Rebuild the summary documents
+from the orders collection once, with the API stopped (writes done while it
+runs are lost), from the repository root:
+    python -m src.database_io.order_statistics
+"""
+import argparse
+import itertools
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from pymongo import UpdateOne
+
+from src.database_io.database_connection import (
+    connect_to_mongo,
+    ECOMMERCE_DATABASE_NAME)
+from src.database_io.resilience import remaining_time_ms
+
+ORDER_STATS_COLLECTION = 'order_stats'
+GLOBAL_STATS_ID = 'global'
+
+
+def user_stats_id(user_id: str) -> str:
+    return f'user:{user_id}'
+
+
+def day_stats_id(day: date) -> str:
+    return f'day:{day.isoformat()}'
+
+
+def get_stats_ids(order: Dict) -> List[str]:
+    """Get the ids of the summary documents an order counts on."""
+    stats_ids = [GLOBAL_STATS_ID, user_stats_id(order['user_id'])]
+    if order.get('created_at') is not None:
+        stats_ids.append(day_stats_id(order['created_at'].date()))
+    return stats_ids
+
+
+def order_created_updates(order: Dict) -> List[UpdateOne]:
+    """Get the summary documents updates for a new order.
+
+    Args:
+        order: order document as saved on database.
+    """
+    increment = {'total': 1, f"by_status.{order['status']}": 1}
+    return [UpdateOne({'_id': stats_id}, {'$inc': increment}, upsert=True)
+            for stats_id in get_stats_ids(order)]
+
+
+def status_changed_updates(order: Dict,
+                           old_status: str,
+                           new_status: str) -> List[UpdateOne]:
+    """Get the summary documents updates for an order status change.
+
+    Args:
+        order: order document, needs the fields user_id and created_at.
+        old_status: status before the update.
+        new_status: status after the update.
+    """
+    if old_status == new_status:
+        return []
+    increment = {f'by_status.{old_status}': -1, f'by_status.{new_status}': 1}
+    return [UpdateOne({'_id': stats_id}, {'$inc': increment}, upsert=True)
+            for stats_id in get_stats_ids(order)]
+
+
+async def apply_stats_updates(db, updates: List[UpdateOne], session=None):
+    """Apply the summary documents updates in a single bulk write, every $inc
+    is atomic on its document so concurrent orders don't lose counts."""
+    if updates:
+        await db[ORDER_STATS_COLLECTION].bulk_write(updates,
+                                                    ordered=False,
+                                                    session=session)
+
+
+async def get_order_stats(db, stats_id: str) -> Dict:
+    """Get a summary document, empty counts if there are no orders for it."""
+    stats: Optional[Dict] = await db[ORDER_STATS_COLLECTION].find_one(
+        {'_id': stats_id},
+        max_time_ms=remaining_time_ms())
+    if stats is None:
+        return {'total': 0, 'by_status': {}}
+    return {'total': stats.get('total', 0),
+            'by_status': stats.get('by_status', {})}
+
+
+def new_order_stats() -> Dict[str, Dict]:
+    """Empty summary documents by stats id, see count_order_stats."""
+    return defaultdict(lambda: {'total': 0, 'by_status': defaultdict(int)})
+
+
+def count_order_stats(orders: Iterable[Dict], stats: Dict[str, Dict]) -> Iterator[Dict]:
+    """Pass the orders through, adding them to the order_stats documents."""
+    for order in orders:
+        for stats_id in get_stats_ids(order):
+            summary = stats[stats_id]
+            summary['total'] += 1
+            summary['by_status'][order['status']] += 1
+        yield order
+
+
+def order_stats_documents(stats: Dict[str, Dict]) -> Iterator[Dict]:
+    """Get the order_stats documents of the counts of count_order_stats."""
+    for stats_id, summary in stats.items():
+        yield {'_id': stats_id,
+               'total': summary['total'],
+               'by_status': dict(summary['by_status'])}
+
+
+def rebuild_order_stats(db, batch_size: int = 10000) -> int:
+    """Rebuild the order_stats collection from the orders collection.
+
+    The new summary documents are written on a temporary collection renamed
+        over order_stats at the end, so readers see the old or the new
+        counts, never partial ones.
+
+    Args:
+        db: pymongo (sync) database.
+        batch_size: documents per insert_many.
+
+    Returns:
+        number of summary documents.
+    """
+    stats = new_order_stats()
+    orders = db.orders.find({}, {'_id': 0, 'user_id': 1, 'status': 1, 'created_at': 1},
+                            batch_size=batch_size)
+    for _ in count_order_stats(orders, stats):
+        pass
+    rebuilt = db[f'{ORDER_STATS_COLLECTION}_rebuild']
+    rebuilt.drop()
+    documents = order_stats_documents(stats)
+    while batch := list(itertools.islice(documents, batch_size)):
+        rebuilt.insert_many(batch, ordered=False)
+    if stats:
+        rebuilt.rename(ORDER_STATS_COLLECTION, dropTarget=True)
+    else:
+        db[ORDER_STATS_COLLECTION].drop()
+    return len(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the order statistics '
+                                                 'from the orders collection')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+    # reading all the orders can take longer than a request socket timeout.
+    client = connect_to_mongo(socketTimeoutMS=None)
+    count = rebuild_order_stats(client[ECOMMERCE_DATABASE_NAME], args.batch_size)
+    print(f'{ORDER_STATS_COLLECTION}: {count} documents')
+
+
+if __name__ == '__main__':
+    main()
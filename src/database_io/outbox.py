@@ -0,0 +1,251 @@
+"""
+Transactional outbox for order events.
+
+Order events (order created, status changed) are written on the order
+document itself, on the pending_events array, by the same write that changes
+the order, so the event is saved if and only if the change is saved and the
+request path stays one write.
+
+OutboxDispatcher runs in the background, claims orders with pending events,
+delivers the events in batches to an EventSink and only then removes them
+from the orders. If delivery fails or the process dies before removing them
+the events are delivered again: delivery is at-least-once, consumers must
+handle duplicates (every event has a unique event_id).
+
+Orders whose events fail max_attempts times on their own are left aside
+(dead letters), they are logged and OutboxDispatcher.requeue_dead_letters
+puts them back once the problem is fixed. A sink outage does not count as an
+attempt of the orders, see OutboxDispatcher.delivery_failed.
+"""
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_FIELD = 'pending_events'
+OUTBOX_DISPATCHER_ENABLED = os.environ.get('OUTBOX_DISPATCHER_ENABLED', 'true').lower() == 'true'
+
+ORDER_CREATED = 'order_created'
+ORDER_STATUS_CHANGED = 'order_status_changed'
+
+
+def build_order_event(event_type: str, payload: Dict) -> Dict:
+    """Build an event to push on the order pending_events.
+
+    Args:
+        event_type: ORDER_CREATED or ORDER_STATUS_CHANGED
+        payload: event data, the dispatcher adds the order id on delivery.
+    """
+    return {'event_id': ObjectId(),
+            'type': event_type,
+            'payload': payload,
+            'created_at': datetime.now(timezone.utc)}
+
+
+class EventSink(ABC):
+    """Where the dispatcher delivers the events."""
+
+    @abstractmethod
+    async def deliver(self, events: List[Dict]) -> None:
+        """Deliver a batch of events.
+
+        Raises:
+            Exception: If the batch could not be delivered, the events will be
+                delivered again later.
+        """
+        pass
+
+
+class InMemoryEventSink(EventSink):
+    """Keep the delivered events on a list, for tests and local runs."""
+
+    def __init__(self):
+        self.events: List[Dict] = []
+
+    async def deliver(self, events: List[Dict]) -> None:
+        self.events.extend(events)
+
+
+class LoggingEventSink(EventSink):
+    """Log the events, default sink until the consumers (notifications,
+    analytics, inventory) have their own."""
+
+    async def deliver(self, events: List[Dict]) -> None:
+        for event in events:
+            logger.info('order event %s %s for order %s', event['event_id'],
+                        event['type'], event['order_id'])
+
+
+class OutboxDispatcher:
+    """Deliver the orders pending events.
+
+    Args:
+        get_db: function returning the (motor) database, it should not go
+            through the API circuit breaker (see get_background_database),
+            the dispatcher has its own backoff.
+        sink: EventSink to deliver the events to.
+        batch_size: max orders claimed per batch.
+        poll_interval: seconds to wait when there are no pending events.
+        lease_seconds: seconds an order stays claimed by a dispatcher, other
+            dispatchers (other workers) skip it meanwhile.
+        max_attempts: failed deliveries after which the order events are left
+            on the order (dead letters) and not retried until requeued.
+        max_backoff: max seconds to wait after consecutive failures.
+    """
+
+    def __init__(self,
+                 get_db: Callable,
+                 sink: EventSink,
+                 batch_size: int = 100,
+                 poll_interval: float = 1,
+                 lease_seconds: float = 30,
+                 max_attempts: int = 10,
+                 max_backoff: float = 60):
+        self.get_db = get_db
+        self.sink = sink
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.task: Optional[asyncio.Task] = None
+        # orders to claim one at a time after a failed batch.
+        self.single_claims = 0
+        # whether the last delivery went through, see delivery_failed.
+        self.sink_up = False
+
+    def claimable_filter(self, now: datetime) -> Dict:
+        return {f'{OUTBOX_FIELD}.event_id': {'$exists': True},
+                'outbox_attempts': {'$not': {'$gte': self.max_attempts}},
+                '$or': [{'outbox_lease_until': {'$exists': False}},
+                        {'outbox_lease_until': {'$lt': now}}]}
+
+    async def claim_batch(self, orders, batch_size: int) -> List[Dict]:
+        """Lease up to batch_size orders with pending events to this
+        dispatcher and return them."""
+        now = datetime.now(timezone.utc)
+        candidates = await orders.find(self.claimable_filter(now),
+                                       {'_id': 1}).limit(batch_size).to_list(None)
+        if not candidates:
+            return []
+        lease_id = ObjectId()
+        await orders.update_many(
+            {'_id': {'$in': [order['_id'] for order in candidates]},
+             **self.claimable_filter(now)},
+            {'$set': {'outbox_lease_id': lease_id,
+                      'outbox_lease_until': now + timedelta(seconds=self.lease_seconds)}})
+        return await orders.find({'outbox_lease_id': lease_id},
+                                 {OUTBOX_FIELD: 1}).to_list(None)
+
+    async def drain_once(self) -> int:
+        """Deliver the events of one batch of orders.
+
+        Returns:
+            number of orders whose events were delivered.
+
+        Raises:
+            Exception: If the sink fails, see delivery_failed.
+        """
+        orders = self.get_db().orders
+        single_claim = self.single_claims > 0
+        claimed = await self.claim_batch(orders, 1 if single_claim else self.batch_size)
+        if not claimed:
+            self.single_claims = 0
+            return 0
+        if single_claim:
+            self.single_claims -= 1
+        events = [{**event, 'order_id': str(order['_id'])}
+                  for order in claimed for event in order[OUTBOX_FIELD]]
+        try:
+            await self.sink.deliver(events)
+        except Exception:
+            await self.delivery_failed(orders, claimed)
+            raise
+        self.sink_up = True
+        # only remove the delivered events, new ones may have been pushed
+        # since we claimed the order.
+        await orders.bulk_write([
+            UpdateOne({'_id': order['_id']},
+                      {'$pull': {OUTBOX_FIELD: {'event_id': {
+                          '$in': [event['event_id'] for event in order[OUTBOX_FIELD]]}}},
+                       '$unset': {'outbox_lease_id': '', 'outbox_lease_until': '',
+                                  'outbox_attempts': ''}})
+            for order in claimed], ordered=False)
+        return len(claimed)
+
+    async def delivery_failed(self, orders, claimed: List[Dict]):
+        """Record a failed delivery of the claimed orders events.
+
+        The failure only counts as an attempt of the order when the batch had
+            that order alone and the previous delivery went through, so the
+            sink is up and the problem are the order events. Otherwise we
+            can't tell (the sink may be down, or one order of the batch is the
+            problem): nothing is counted, the orders are released and claimed
+            one at a time next. A single order that fails stays leased, so
+            the next claims go on with the other orders.
+        """
+        sink_was_up, self.sink_up = self.sink_up, False
+        if len(claimed) > 1:
+            self.single_claims = len(claimed)
+            await orders.update_many(
+                {'_id': {'$in': [order['_id'] for order in claimed]}},
+                {'$unset': {'outbox_lease_id': '', 'outbox_lease_until': ''}})
+            return
+        if not sink_was_up:
+            return
+        order = await orders.find_one_and_update(
+            {'_id': claimed[0]['_id']},
+            {'$inc': {'outbox_attempts': 1}},
+            projection={'outbox_attempts': 1},
+            return_document=ReturnDocument.AFTER)
+        if order is not None and order['outbox_attempts'] >= self.max_attempts:
+            logger.error('order %s events failed %s deliveries, left as dead letters '
+                         'until requeued', order['_id'], order['outbox_attempts'])
+
+    async def requeue_dead_letters(self) -> int:
+        """Reset the attempts of the dead letter orders so their events are
+        delivered again.
+
+        Returns:
+            number of orders requeued.
+        """
+        result = await self.get_db().orders.update_many(
+            {'outbox_attempts': {'$gte': self.max_attempts}},
+            {'$unset': {'outbox_attempts': ''}})
+        return result.modified_count
+
+    async def run(self):
+        """Drain the outbox until stopped, backing off after failures."""
+        backoff = self.poll_interval
+        while True:
+            try:
+                drained = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('order events delivery failed, retrying in %ss', backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.poll_interval
+            if drained < self.batch_size and not self.single_claims:
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,187 @@
+"""
+Request deadlines and circuit breaker for the database calls.
+
+Every request gets a deadline (REQUEST_TIMEOUT_SECONDS from the moment it
+arrives), database calls use the time left as maxTimeMS, so the server stops
+working on queries nobody waits for, and as asyncio timeout, so we stop
+waiting even when the server or the network does not answer. The asyncio
+timeout can't stop the motor executor thread running the call, the client
+timeouts (DATABASE_CLIENT_OPTIONS on database_connection.py) bound that.
+
+The circuit breaker counts consecutive database failures, after
+failure_threshold failures it opens and the database calls fail straight
+away, without waiting for pymongo timeouts, until reset_timeout seconds have
+passed and a trial request goes through. The breaker is checked once per
+request, all the database calls of a request it let through go ahead.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Dict, Optional, Set
+
+from pymongo.errors import (
+    ConnectionFailure,
+    ExecutionTimeout,
+    NetworkTimeout,
+    WTimeoutError)
+
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get('REQUEST_TIMEOUT_SECONDS', 5))
+
+_request_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline',
+                                                            default=None)
+# Circuit breakers that already let the current request through, None
+# outside of a request.
+_request_admissions: ContextVar[Optional[Set['CircuitBreaker']]] = ContextVar(
+    'request_admissions', default=None)
+
+
+class DatabaseUnavailable(Exception):
+    """The database can not be reached or the circuit breaker is open."""
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time waiting for the database."""
+
+
+def set_request_deadline(timeout: float = REQUEST_TIMEOUT_SECONDS):
+    """Set the current request deadline 'timeout' seconds from now.
+
+    Returns:
+        token to reset the deadline with reset_request_deadline.
+    """
+    return _request_deadline.set(time.monotonic() + timeout)
+
+
+def reset_request_deadline(token):
+    _request_deadline.reset(token)
+
+
+def start_request_admissions():
+    """Start recording the circuit breakers that let the current request
+    through, so each breaker is checked once per request.
+
+    Returns:
+        token to reset it with reset_request_admissions.
+    """
+    return _request_admissions.set(set())
+
+
+def reset_request_admissions(token):
+    _request_admissions.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left until the request deadline, None if there is no deadline.
+
+    Raises:
+        DeadlineExceeded: If the deadline already passed.
+    """
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining
+
+
+def remaining_time_ms() -> Optional[int]:
+    """Milliseconds left until the request deadline, to use as max_time_ms on
+    find operations."""
+    remaining = remaining_time()
+    if remaining is None:
+        return None
+    return max(1, int(remaining * 1000))
+
+
+def max_time_ms_option() -> Dict:
+    """maxTimeMS keyword argument for commands that accept it
+    (count_documents, distinct, find_one_and_update...)."""
+    max_time_ms = remaining_time_ms()
+    return {} if max_time_ms is None else {'maxTimeMS': max_time_ms}
+
+
+class CircuitBreaker:
+    """Consecutive failures circuit breaker.
+
+    Args:
+        failure_threshold: consecutive failures that open the circuit.
+        reset_timeout: seconds the circuit stays open before letting a trial
+            call go through (half open), if the trial fails it opens again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # half open, let this call try, the next one waits for another
+            # reset_timeout unless this one succeeds and closes the circuit.
+            self.opened_at = now
+            return True
+        return False
+
+    def allow_current_request(self) -> bool:
+        """allow_request once per request.
+
+        The following calls of a request already let through are allowed,
+            checking again would take the half open trial slot from the trial
+            request itself and reject it before it can close the circuit.
+        """
+        admissions = _request_admissions.get()
+        if admissions is None:
+            return self.allow_request()
+        if self in admissions:
+            return True
+        allowed = self.allow_request()
+        if allowed:
+            admissions.add(self)
+        return allowed
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    @contextmanager
+    def track(self):
+        """Record the result of the database calls done inside the block,
+        translating timeouts to DeadlineExceeded and connection errors to
+        DatabaseUnavailable."""
+        try:
+            yield
+        except (asyncio.TimeoutError, ExecutionTimeout, NetworkTimeout,
+                WTimeoutError) as error:
+            self.record_failure()
+            raise DeadlineExceeded() from error
+        except ConnectionFailure as error:
+            self.record_failure()
+            raise DatabaseUnavailable() from error
+        self.record_success()
+
+    async def call(self, awaitable: Awaitable):
+        """Await a database call within the request deadline."""
+        try:
+            timeout = remaining_time()
+        except DeadlineExceeded:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise
+        with self.track():
+            return await asyncio.wait_for(awaitable, timeout)
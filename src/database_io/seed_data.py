@@ -0,0 +1,238 @@
+"""
+Deterministic seed data generator for performance tests and benchmarks.
+
+Generates products, users and orders with realistic distributions:
+    - product popularity follows a Zipf law, a few hot SKUs get a large
+      share of the order lines.
+    - orders per user follow a long tail (most users have a few orders, some
+      have many).
+    - order dates are spread over the last 'days' days, older orders are
+      mostly delivered, recent ones still in progress.
+
+Same seed, same data. The order_stats summary documents are built while the
+orders are generated so they match the orders collection.
+
+Load into the local MongoDB from the repository root:
+    python -m src.database_io.seed_data --products 1000000 --users 200000
+"""
+import argparse
+import itertools
+import math
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator
+
+from src.api.api_v1.endpoints.models.documents import (
+    price_order_lines,
+    OrderDocument)
+from src.api.api_v1.endpoints.models.model_enums import (
+    AllowedCountries,
+    OrderStatus)
+from src.database_io.database_connection import (
+    connect_to_mongo,
+    ECOMMERCE_DATABASE_NAME)
+from src.database_io.indexes import ensure_indexes
+from src.database_io.order_statistics import (
+    count_order_stats,
+    new_order_stats,
+    order_stats_documents,
+    ORDER_STATS_COLLECTION)
+
+PRODUCT_TYPES = ['Video Game', 'Electronics', 'Books', 'Furniture', 'Kitchen',
+                 'Toys', 'Clothes', 'Garden']
+CITIES = ['London', 'Manchester', 'Paris', 'Lyon', 'Berlin', 'Munich', 'Hyrule']
+# Order status by order age, the first matching max age in days wins.
+STATUS_BY_AGE = [
+    (1, [OrderStatus.REQUESTING, OrderStatus.ACCEPTED, OrderStatus.CANCELLED],
+     [60, 35, 5]),
+    (5, [OrderStatus.ACCEPTED, OrderStatus.IN_PROGRESS, OrderStatus.DISPATCHED,
+         OrderStatus.CANCELLED],
+     [20, 40, 35, 5]),
+    (math.inf, [OrderStatus.DELIVERED, OrderStatus.CANCELLED], [93, 7]),
+]
+
+
+class SeedConfig:
+    """Seed data sizes and distributions.
+
+    Args:
+        products: number of products.
+        users: number of users.
+        mean_orders_per_user: mean of the orders per user long tail.
+        max_products_per_order: an order has 1 to max_products_per_order lines.
+        product_skew: Zipf exponent of the products popularity, 0 is uniform.
+        days: orders are spread over the 'days' days before end_date.
+        end_date: date of the newest orders.
+        seed: random seed.
+        batch_size: documents per insert_many.
+    """
+
+    def __init__(self,
+                 products: int = 1000,
+                 users: int = 200,
+                 mean_orders_per_user: float = 5,
+                 max_products_per_order: int = 5,
+                 product_skew: float = 1.1,
+                 days: int = 365,
+                 end_date: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc),
+                 seed: int = 42,
+                 batch_size: int = 10000):
+        self.products = products
+        self.users = users
+        self.mean_orders_per_user = mean_orders_per_user
+        self.max_products_per_order = max_products_per_order
+        self.product_skew = product_skew
+        self.days = days
+        self.end_date = end_date
+        self.seed = seed
+        self.batch_size = batch_size
+
+
+def deterministic_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate_products(config: SeedConfig) -> Iterator[Dict]:
+    rng = random.Random(f'{config.seed}-products')
+    for index in range(config.products):
+        product_type = rng.choice(PRODUCT_TYPES)
+        yield {'product_id': deterministic_uuid(rng),
+               'name': f'{product_type} {index}',
+               'price': round(rng.lognormvariate(3.5, 1), 2),
+               'available_count': rng.randint(0, 500),
+               'type': product_type}
+
+
+def generate_address(rng: random.Random) -> Dict:
+    return {'street_name': f'{rng.randint(1, 300)} Main street',
+            'city': rng.choice(CITIES),
+            'country': rng.choice(list(AllowedCountries)).value,
+            'post_code': f'{rng.randint(10000, 99999)}',
+            'apartment': rng.choice([None, rng.randint(1, 50)])}
+
+
+def generate_users(config: SeedConfig) -> Iterator[Dict]:
+    rng = random.Random(f'{config.seed}-users')
+    for index in range(config.users):
+        yield {'user_id': f'user-{index}',
+               'username': f'user{index}',
+               'address': generate_address(rng)}
+
+
+def get_order_status(rng: random.Random, age_days: float) -> OrderStatus:
+    for max_age, statuses, weights in STATUS_BY_AGE:
+        if age_days <= max_age:
+            return rng.choices(statuses, weights)[0]
+
+
+def generate_orders(config: SeedConfig, products_by_id: Dict[str, Dict]) -> Iterator[Dict]:
+    """Generate the orders of every user, priced like create-order does.
+
+    Args:
+        config: SeedConfig
+        products_by_id: the generated products (at least their price) by
+            product id, in generation order, the first ones are the most
+            popular.
+    """
+    product_ids = list(products_by_id)
+    rng = random.Random(f'{config.seed}-orders')
+    cumulative_weights = list(itertools.accumulate(
+        1 / (rank ** config.product_skew) for rank in range(1, len(product_ids) + 1)))
+    # Pareto with alpha 2 has mean 2, scale it to the configured mean.
+    orders_scale = config.mean_orders_per_user / 2
+    for user in generate_users(config):
+        orders_count = int(rng.paretovariate(2) * orders_scale)
+        for _ in range(orders_count):
+            age_days = rng.uniform(0, config.days)
+            lines = rng.randint(1, config.max_products_per_order)
+            products, totals = price_order_lines(
+                ((product_id, rng.randint(1, 3))
+                 for product_id in dict.fromkeys(rng.choices(
+                     product_ids, cum_weights=cumulative_weights, k=lines))),
+                user['address']['country'],
+                products_by_id)
+            yield OrderDocument(
+                user_id=user['user_id'],
+                products=products,
+                delivery_address=user['address'],
+                status=get_order_status(rng, age_days),
+                created_at=config.end_date - timedelta(days=age_days),
+                totals=totals).to_bson()
+
+
+def insert_in_batches(collection, documents: Iterable[Dict], batch_size: int) -> int:
+    inserted = 0
+    documents = iter(documents)
+    while batch := list(itertools.islice(documents, batch_size)):
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+def bulk_load(db, config: SeedConfig) -> Dict[str, int]:
+    """Generate the seed data and insert it on the database.
+
+    Args:
+        db: pymongo (sync) database.
+        config: SeedConfig
+
+    Returns:
+        documents inserted by collection.
+    """
+    # only the price is kept, to price the orders.
+    prices_by_id = {}
+
+    def keep_product_prices(products):
+        for product in products:
+            prices_by_id[product['product_id']] = {'price': product['price']}
+            yield product
+
+    stats = new_order_stats()
+    inserted = {
+        'products': insert_in_batches(db.products,
+                                      keep_product_prices(generate_products(config)),
+                                      config.batch_size),
+        'users': insert_in_batches(db.users, generate_users(config), config.batch_size),
+        'orders': insert_in_batches(
+            db.orders,
+            count_order_stats(generate_orders(config, prices_by_id), stats),
+            config.batch_size),
+    }
+    inserted[ORDER_STATS_COLLECTION] = insert_in_batches(
+        db[ORDER_STATS_COLLECTION],
+        order_stats_documents(stats),
+        config.batch_size)
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load seed data on MongoDB')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--mean-orders-per-user', type=float, default=5)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--drop', action='store_true',
+                        help='drop the database before loading')
+    args = parser.parse_args()
+
+    # big insert_many batches can take longer than a request socket timeout.
+    client = connect_to_mongo(socketTimeoutMS=None)
+    if args.drop:
+        client.drop_database(ECOMMERCE_DATABASE_NAME)
+    db = client[ECOMMERCE_DATABASE_NAME]
+    ensure_indexes(db)
+    inserted = bulk_load(db, SeedConfig(products=args.products,
+                                        users=args.users,
+                                        mean_orders_per_user=args.mean_orders_per_user,
+                                        days=args.days,
+                                        seed=args.seed,
+                                        batch_size=args.batch_size))
+    for collection_name, count in inserted.items():
+        print(f'{collection_name}: {count} documents')
+
+
+if __name__ == '__main__':
+    main()
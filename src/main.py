@@ -1,11 +1,66 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 from mangum import Mangum
 from src.api.api_v1.api import router as api_router
+from src.api.rate_limiting import (
+    ConcurrencyLimitMiddleware,
+    RateLimitMiddleware,
+    RATE_LIMIT_ENABLED)
+from src.api.request_deadline import RequestDeadlineMiddleware
+from src.database_io.database_connection import get_background_database
+from src.database_io.outbox import (
+    LoggingEventSink,
+    OutboxDispatcher,
+    OUTBOX_DISPATCHER_ENABLED)
+from src.database_io.resilience import (
+    DatabaseUnavailable,
+    DeadlineExceeded)
 
 app = FastAPI()
 
 app.include_router(api_router, prefix="/api/v1")
 
+# Last added middleware runs first, so rate limited requests are rejected
+# before they take an in flight slot, and the deadline counts from the moment
+# the request arrives.
+app.add_middleware(ConcurrencyLimitMiddleware)
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+app.add_middleware(RequestDeadlineMiddleware)
+
+
+order_events_dispatcher = OutboxDispatcher(get_background_database, LoggingEventSink())
+
+
+@app.on_event("startup")
+async def start_order_events_dispatcher():
+    if OUTBOX_DISPATCHER_ENABLED:
+        order_events_dispatcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_order_events_dispatcher():
+    await order_events_dispatcher.stop()
+
+
+@app.get("/health", include_in_schema=False)
+async def health():
+    """Liveness check for load balancers, does not touch the database."""
+    return {"status": "ok"}
+
+
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailable):
+    return JSONResponse(content={"detail": "Database unavailable"},
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={"Retry-After": "5"})
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(content={"detail": "Request timed out"},
+                        status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+
 
 # Uncomment the line below and you can have it on aws lambda
-#handler = Mangum(app)
\ No newline at end of file
+#handler = Mangum(app)
@@ -0,0 +1,233 @@
+"""
+Price and order totals computation.
+
+Money is computed in Decimal and rounded to cents with ROUND_HALF_UP:
+    line gross = unit price * quantity
+    line discount = line gross * discount rate (rounded to cents)
+    line total = line gross - line discount
+    subtotal = sum of line gross, discount = sum of line discounts
+    tax = (subtotal - discount) * country tax rate (rounded to cents)
+    total = subtotal - discount + tax
+
+Discount and tax rates have basis point (0.0001) precision. Amounts are
+saved on database as integer cents (exact and much cheaper to encode than
+Decimal128).
+
+price_order is the single order path. price_orders_batch computes the same
+totals for many orders at once with NumPy, working on integer cents and
+basis points so the results are exactly the ones of the Decimal path.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from src.api.api_v1.endpoints.models.model_enums import AllowedCountries
+
+CENT = Decimal('0.01')
+BASIS_POINT = Decimal('0.0001')
+BASIS_POINTS_PER_UNIT = 10000
+ZERO_MONEY = Decimal('0.00')
+ZERO_RATE = Decimal('0.0000')
+
+TAX_RATES: Dict[AllowedCountries, Decimal] = {
+    AllowedCountries.UK: Decimal('0.20'),
+    AllowedCountries.FRANCE: Decimal('0.20'),
+    AllowedCountries.GERMANY: Decimal('0.19'),
+}
+
+Number = Union[Decimal, float, int, str]
+
+
+def to_money(value: Number) -> Decimal:
+    """Convert to Decimal rounded to cents, floats go through str so 50.95
+    is 50.95 and not 50.9500000000000028..."""
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_rate(value: Optional[Number]) -> Decimal:
+    """Convert a rate (0.2 is 20%) to Decimal with basis point precision."""
+    if not value:
+        return ZERO_RATE
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(BASIS_POINT, rounding=ROUND_HALF_UP)
+
+
+def to_cents(value: Decimal) -> int:
+    """Convert a Decimal amount rounded to cents to integer cents."""
+    return int(value * 100)
+
+
+def line_amounts(price: Number,
+                 quantity: int,
+                 discount: Optional[Number] = None) -> Tuple[Decimal, Decimal]:
+    """Get an order line gross amount and discount amount.
+
+    Args:
+        price: unit price.
+        quantity: number of units.
+        discount: discount rate, 0.1 is 10% off.
+    """
+    gross = to_money(price) * quantity
+    rate = to_rate(discount)
+    if not rate:
+        return gross, ZERO_MONEY
+    return gross, (gross * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def line_total(price: Number, quantity: int, discount: Optional[Number] = None) -> Decimal:
+    gross, discount_amount = line_amounts(price, quantity, discount)
+    return gross - discount_amount
+
+
+class OrderTotals:
+    """Order totals, all Decimal rounded to cents, line_totals has the total
+    of each order line."""
+    __slots__ = ('subtotal', 'discount', 'tax', 'total', 'line_totals')
+
+    def __init__(self,
+                 subtotal: Decimal,
+                 discount: Decimal,
+                 tax: Decimal,
+                 total: Decimal,
+                 line_totals: Optional[List[Decimal]] = None):
+        self.subtotal = subtotal
+        self.discount = discount
+        self.tax = tax
+        self.total = total
+        self.line_totals = line_totals or []
+
+    def __eq__(self, other):
+        return isinstance(other, OrderTotals) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f'OrderTotals({self.to_dict()})'
+
+    def to_dict(self) -> Dict[str, Decimal]:
+        return {'subtotal': self.subtotal,
+                'discount': self.discount,
+                'tax': self.tax,
+                'total': self.total}
+
+    def to_bson(self) -> Dict[str, int]:
+        """Totals in integer cents, e.g. {'subtotal_cents': 1095, ...}"""
+        return {f'{name}_cents': to_cents(value) for name, value in self.to_dict().items()}
+
+
+def price_order(lines: Iterable[Tuple[Number, int, Optional[Number]]],
+                country: AllowedCountries) -> OrderTotals:
+    """Compute an order totals.
+
+    Args:
+        lines: (unit price, quantity, discount rate) of each order line.
+        country: delivery country, selects the tax rate.
+    """
+    subtotal = ZERO_MONEY
+    discount = ZERO_MONEY
+    line_totals = []
+    for price, quantity, line_discount in lines:
+        gross, discount_amount = line_amounts(price, quantity, line_discount)
+        subtotal += gross
+        discount += discount_amount
+        line_totals.append(gross - discount_amount)
+    tax = ((subtotal - discount) * TAX_RATES[country]).quantize(CENT, rounding=ROUND_HALF_UP)
+    return OrderTotals(subtotal=subtotal,
+                       discount=discount,
+                       tax=tax,
+                       total=subtotal - discount + tax,
+                       line_totals=line_totals)
+
+
+def to_fixed_point(values: Sequence[Number], exponent: Decimal) -> np.ndarray:
+    """Convert values to int64 multiples of exponent (CENT or BASIS_POINT),
+    rounding half up on the decimal value like to_money and to_rate.
+
+    np.rint rounds half to even on the binary value, 0.125 is 12 cents and
+    1.005 (1.00499999... in binary) is 100 cents, instead of 13 and 101. Only
+    the values that are a half (or nearly) once scaled go through Decimal.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = int(1 / exponent)
+    scaled = values * scale
+    fixed = np.rint(scaled)
+    distance_to_half = np.abs(scaled - np.floor(scaled) - 0.5)
+    for index in np.flatnonzero(distance_to_half <= 1e-9 * np.maximum(1, np.abs(scaled))):
+        fixed[index] = Decimal(str(float(values[index]))).quantize(
+            exponent, rounding=ROUND_HALF_UP) * scale
+    return fixed.astype(np.int64)
+
+
+def round_half_up_divide(numerator: np.ndarray, denominator: int) -> np.ndarray:
+    """Integer division rounding half up, for non negative int64 arrays."""
+    return (numerator + denominator // 2) // denominator
+
+
+def price_orders_batch(prices: Sequence[float],
+                       quantities: Sequence[int],
+                       discounts: Sequence[float],
+                       order_index: Sequence[int],
+                       countries: Sequence[AllowedCountries]) -> Dict[str, np.ndarray]:
+    """Compute the totals of many orders at once.
+
+    The lines of all the orders are given as flat arrays, order_index says
+    which order each line belongs to.
+
+    Args:
+        prices: unit price of each line.
+        quantities: quantity of each line.
+        discounts: discount rate of each line, 0 for no discount.
+        order_index: index of the order of each line, from 0 to len(countries) - 1.
+        countries: delivery country of each order.
+
+    Returns:
+        dict with 'subtotal', 'discount', 'tax' and 'total' int64 arrays of
+            cents, one value per order.
+    """
+    orders_count = len(countries)
+    order_index = np.asarray(order_index, dtype=np.int64)
+    price_cents = to_fixed_point(prices, CENT)
+    discount_points = to_fixed_point(discounts, BASIS_POINT)
+    gross = price_cents * np.asarray(quantities, dtype=np.int64)
+    line_discount = round_half_up_divide(gross * discount_points, BASIS_POINTS_PER_UNIT)
+
+    subtotal = np.zeros(orders_count, dtype=np.int64)
+    discount = np.zeros(orders_count, dtype=np.int64)
+    np.add.at(subtotal, order_index, gross)
+    np.add.at(discount, order_index, line_discount)
+
+    tax_points_by_country = {country: int(rate * BASIS_POINTS_PER_UNIT)
+                             for country, rate in TAX_RATES.items()}
+    tax_points = np.fromiter((tax_points_by_country[country] for country in countries),
+                             dtype=np.int64, count=orders_count)
+    tax = round_half_up_divide((subtotal - discount) * tax_points, BASIS_POINTS_PER_UNIT)
+    return {'subtotal': subtotal,
+            'discount': discount,
+            'tax': tax,
+            'total': subtotal - discount + tax}
+
+
+def price_order_documents(orders: Sequence[Dict],
+                          products_by_id: Dict[str, Dict]) -> Dict[str, np.ndarray]:
+    """Reprice saved orders with the current products price and discount,
+    e.g. for reports or to preview a price change.
+
+    Args:
+        orders: order documents, as saved on the orders collection.
+        products_by_id: product documents by product id.
+
+    Returns:
+        price_orders_batch totals, in the same order as 'orders'.
+    """
+    prices, quantities, discounts, order_index = [], [], [], []
+    for index, order in enumerate(orders):
+        for line in order['products']:
+            product = products_by_id[line['product_id']]
+            prices.append(product['price'])
+            quantities.append(line['amount'])
+            discounts.append(product.get('discount') or 0)
+            order_index.append(index)
+    return price_orders_batch(prices, quantities, discounts, order_index,
+                              [order['delivery_address']['country'] for order in orders])
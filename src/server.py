@@ -0,0 +1,108 @@
+"""
+Production server entry point.
+
+Runs the app on gunicorn with uvicorn workers (uvloop event loop and httptools
+HTTP parser), one worker per core by default:
+
+    python -m src.server
+    python -m src.server --workers 4 --bind 0.0.0.0:8000
+
+Before forking the workers the master process checks the database is
+reachable and creates the missing indexes, then each worker creates its own
+MongoDB clients after fork.
+"""
+import argparse
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from src.database_io.database_connection import (
+    connect_to_mongo,
+    reset_database_connections,
+    ECOMMERCE_DATABASE_NAME)
+from src.database_io.indexes import check_database
+
+SERVER_BIND = os.environ.get('SERVER_BIND', '0.0.0.0:8000')
+SERVER_WORKERS = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Keep alive longer than the load balancer idle timeout (60s on AWS ALB) so
+# the load balancer closes idle connections, not us.
+SERVER_KEEP_ALIVE_SECONDS = int(os.environ.get('SERVER_KEEP_ALIVE_SECONDS', 75))
+SERVER_BACKLOG = int(os.environ.get('SERVER_BACKLOG', 2048))
+SERVER_GRACEFUL_TIMEOUT_SECONDS = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT_SECONDS', 30))
+
+
+class EcommerceUvicornWorker(UvicornWorker):
+    CONFIG_KWARGS = {
+        'loop': 'uvloop',
+        'http': 'httptools',
+        'lifespan': 'on',
+        'timeout_keep_alive': SERVER_KEEP_ALIVE_SECONDS,
+    }
+
+
+def check_database_on_start(server):
+    """gunicorn on_starting hook, runs on the master before forking."""
+    client = connect_to_mongo()
+    try:
+        check_database(client, ECOMMERCE_DATABASE_NAME)
+    finally:
+        client.close()
+    server.log.info('Database reachable and indexes in place')
+
+
+def reset_connections_after_fork(server, worker):
+    """gunicorn post_fork hook, runs on each worker after fork."""
+    reset_database_connections()
+
+
+class EcommerceServer(BaseApplication):
+    """Run src.main:app on gunicorn without a gunicorn config file."""
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from src.main import app
+        return app
+
+
+def get_server_options(workers: int = SERVER_WORKERS,
+                       bind: str = SERVER_BIND,
+                       self_check: bool = True) -> dict:
+    options = {
+        'bind': bind,
+        'workers': workers,
+        'worker_class': 'src.server.EcommerceUvicornWorker',
+        'backlog': SERVER_BACKLOG,
+        'keepalive': SERVER_KEEP_ALIVE_SECONDS,
+        'graceful_timeout': SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        # import the app once on the master, workers share that memory.
+        'preload_app': True,
+        'post_fork': reset_connections_after_fork,
+    }
+    if self_check:
+        options['on_starting'] = check_database_on_start
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the e-commerce API server')
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    parser.add_argument('--bind', default=SERVER_BIND)
+    parser.add_argument('--skip-self-check', action='store_true',
+                        help='do not check the database before starting')
+    args = parser.parse_args()
+    EcommerceServer(get_server_options(workers=args.workers,
+                                       bind=args.bind,
+                                       self_check=not args.skip_self_check)).run()
+
+
+if __name__ == '__main__':
+    main()
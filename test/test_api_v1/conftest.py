@@ -10,13 +10,17 @@ from pathlib import Path
 from bson.objectid import ObjectId
 from src.database_io.database_connection import MongoDbLocalConnection
 from src.database_io import database_connection as mongo_init
+from src.database_io.seed_data import bulk_load, SeedConfig
 import motor.motor_asyncio
 from src.api.api_v1.endpoints.models.model_enums import OrderStatus
 random.seed()
 
 
 """Empty the database for every test, Note that we have an ASYNC and a SYNC  
-connection to pymongo so we can do calls to database in async and sync way."""
+connection to pymongo so we can do calls to database in async and sync way.
+Tests run on a standalone local mongod, there the order writes run without
+a transaction (see run_in_transaction) and no operation times are returned,
+the transaction and causal session paths are tested with mocks."""
 @pytest.fixture(autouse=True)
 async def replace_mongodb_with_mockdb():
     if mongo_init.MONGO_CONNECTION is None:
@@ -71,6 +75,22 @@ async def insert_order(set_products_data, address) -> ObjectId:
     return order_id.inserted_id
 
 
+@pytest.fixture()
+def large_dataset() -> Dict[str, int]:
+    """Load generated seed data on database, for performance tests.
+
+    Sizes come from the environment variables PERF_PRODUCTS, PERF_USERS and
+    PERF_MEAN_ORDERS_PER_USER, small by default so it can run with the unit
+    tests, set them to production sizes to benchmark.
+    """
+    config = SeedConfig(
+        products=int(os.environ.get('PERF_PRODUCTS', 1000)),
+        users=int(os.environ.get('PERF_USERS', 200)),
+        mean_orders_per_user=float(os.environ.get('PERF_MEAN_ORDERS_PER_USER', 5)))
+    db = mongo_init.SYNC_MONGO_CONNECTION[mongo_init.ECOMMERCE_DATABASE_NAME]
+    return bulk_load(db, config)
+
+
 @pytest.fixture(scope='session')
 def event_loop():
     """Fixture to modify event loop in case of async test with parametrize."""
@@ -0,0 +1,202 @@
+import json
+import time
+import uuid
+from datetime import timedelta
+from typing import Optional
+
+import jwt
+import pytest
+from httpx import AsyncClient
+
+from src.api import auth
+from src.api.auth import (
+    create_access_token,
+    JWKSKeyProvider,
+    SecretKeyProvider,
+    TokenVerifier)
+from src.cache import TTLCache
+from src.database_io import database_connection as mongo_init
+from src.main import app
+
+
+@pytest.fixture()
+async def user():
+    """Save a user on database and clear the auth caches"""
+    auth.USER_CACHE.clear()
+    auth.REVOKED_TOKEN_IDS.clear()
+    auth.NOT_REVOKED_TOKEN_IDS.clear()
+    auth.get_token_verifier().cache.clear()
+    db = mongo_init.MONGO_CONNECTION[mongo_init.ECOMMERCE_DATABASE_NAME]
+    user_data = {'username': 'link',
+                 'user_id': 'Link',
+                 'email': 'link@hyrule.com',
+                 'full_name': 'Link',
+                 'disabled': False}
+    await db.users.insert_one(dict(user_data))
+    return user_data
+
+
+def bearer(token: str):
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture(scope='module')
+def rsa_key():
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture()
+def jwks_provider(mocker, rsa_key):
+    """JWKSKeyProvider with the key set fetch mocked, the set has the key
+    'known'"""
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(rsa_key.public_key()))
+    provider = JWKSKeyProvider('http://test/jwks', min_refresh_interval=30)
+    mocker.patch.object(provider.client, 'fetch_data',
+                        return_value={'keys': [{**jwk, 'kid': 'known', 'use': 'sig'}]})
+    return provider
+
+
+def rsa_token(rsa_key, kid: Optional[str]) -> str:
+    headers = {'kid': kid} if kid is not None else None
+    return jwt.encode({'sub': 'link', 'jti': uuid.uuid4().hex, 'exp': time.time() + 60},
+                      rsa_key, algorithm='RS256', headers=headers)
+
+
+@pytest.mark.unit
+async def test_users_me_returns_token_user(user):
+    """Test a valid token gets the user saved on database"""
+    token = create_access_token(user['username'])
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/api/v1/products/users/me', headers=bearer(token))
+    assert response.status_code == 200
+    assert json.loads(response.content) == user
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('token', [
+    'not-a-token',
+    jwt.encode({'sub': 'link', 'jti': '1', 'exp': 4102444800}, 'other-secret'),
+    jwt.encode({'sub': 'link', 'jti': '1'}, 'test-secret'),
+])
+async def test_users_me_rejects_invalid_token(user, token):
+    """Test a token with a bad signature or without expiry gets a 401"""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/api/v1/products/users/me', headers=bearer(token))
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+
+@pytest.mark.unit
+async def test_users_me_rejects_expired_token(user):
+    """Test an expired token gets a 401"""
+    token = create_access_token(user['username'], expires_in=timedelta(seconds=-1))
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/api/v1/products/users/me', headers=bearer(token))
+    assert response.status_code == 401
+
+
+@pytest.mark.unit
+async def test_users_me_rejects_unknown_user(user):
+    """Test a valid token of a user that does not exist gets a 401"""
+    token = create_access_token('ganon')
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/api/v1/products/users/me', headers=bearer(token))
+    assert response.status_code == 401
+
+
+@pytest.mark.unit
+async def test_revoked_token_is_rejected(user):
+    """Test a token can't be used after it is revoked, even if its claims
+    were cached"""
+    token = create_access_token(user['username'])
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/api/v1/products/users/me', headers=bearer(token))
+        assert response.status_code == 200
+        response = await ac.post('/api/v1/users/revoke-token', headers=bearer(token))
+        assert response.status_code == 204
+        response = await ac.get('/api/v1/products/users/me', headers=bearer(token))
+    assert response.status_code == 401
+    db = mongo_init.MONGO_CONNECTION[mongo_init.ECOMMERCE_DATABASE_NAME]
+    jti = jwt.decode(token, 'test-secret', algorithms=['HS256'])['jti']
+    assert await db.revoked_tokens.count_documents({'_id': jti}) == 1
+
+
+@pytest.mark.unit
+async def test_token_revoked_by_other_process_is_rejected(user):
+    """Test a token with cached claims is rejected once another process
+    revoked it and the revocation check interval passed"""
+    token = create_access_token(user['username'])
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/api/v1/products/users/me', headers=bearer(token))
+        assert response.status_code == 200
+        db = mongo_init.MONGO_CONNECTION[mongo_init.ECOMMERCE_DATABASE_NAME]
+        jti = jwt.decode(token, 'test-secret', algorithms=['HS256'])['jti']
+        await db.revoked_tokens.insert_one({'_id': jti})
+        # the claims are still cached, as if the check interval passed.
+        auth.NOT_REVOKED_TOKEN_IDS.clear()
+        response = await ac.get('/api/v1/products/users/me', headers=bearer(token))
+    assert response.status_code == 401
+
+
+@pytest.mark.unit
+async def test_users_me_rejects_token_without_jwks_key(mocker, user, jwks_provider, rsa_key):
+    """Test tokens get a 401 (and not a 500) in JWKS mode when the key set is
+    empty or has no key for the token kid"""
+    mocker.patch.object(auth, 'TOKEN_VERIFIER',
+                        TokenVerifier(jwks_provider, 'RS256', TTLCache(maxsize=10, ttl=60)))
+    keys = jwks_provider.client.fetch_data.return_value
+    jwks_provider.client.fetch_data.return_value = {'keys': []}
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/api/v1/products/users/me',
+                                headers=bearer(rsa_token(rsa_key, 'known')))
+        assert response.status_code == 401
+        jwks_provider.client.fetch_data.return_value = keys
+        jwks_provider.refreshed_at = -float('inf')
+        response = await ac.get('/api/v1/products/users/me',
+                                headers=bearer(rsa_token(rsa_key, 'unknown')))
+        assert response.status_code == 401
+        response = await ac.get('/api/v1/products/users/me',
+                                headers=bearer(rsa_token(rsa_key, 'known')))
+        assert response.status_code == 200
+
+
+@pytest.mark.unit
+async def test_jwks_provider_rate_limits_refreshes_for_unknown_kids(jwks_provider, rsa_key):
+    """Test the key set is fetched once and unknown kids don't fetch it
+    again before min_refresh_interval"""
+    key = await jwks_provider.get_key(rsa_token(rsa_key, 'known'))
+    assert key.public_numbers() == rsa_key.public_key().public_numbers()
+    for kid in ['made-up-1', 'made-up-2', None]:
+        with pytest.raises(jwt.PyJWKClientError):
+            await jwks_provider.get_key(rsa_token(rsa_key, kid))
+    await jwks_provider.get_key(rsa_token(rsa_key, 'known'))
+    assert jwks_provider.client.fetch_data.call_count == 1
+
+
+@pytest.mark.unit
+async def test_token_verifier_caches_claims(mocker):
+    """Test the signature is only verified the first time a token is seen"""
+    verifier = TokenVerifier(SecretKeyProvider('test-secret'), 'HS256',
+                             TTLCache(maxsize=10, ttl=60))
+    decode = mocker.spy(jwt, 'decode')
+    token = create_access_token('link')
+    first = await verifier.verify(token)
+    second = await verifier.verify(token)
+    assert first == second
+    assert first['sub'] == 'link'
+    assert decode.call_count == 1
+    verifier.forget(token)
+    await verifier.verify(token)
+    assert decode.call_count == 2
+
+
+@pytest.mark.unit
+async def test_token_verifier_cache_ends_at_token_expiry():
+    """Test claims are not cached longer than the token is valid"""
+    verifier = TokenVerifier(SecretKeyProvider('test-secret'), 'HS256',
+                             TTLCache(maxsize=10, ttl=60))
+    token = create_access_token('link', expires_in=timedelta(seconds=1))
+    await verifier.verify(token)
+    _, expires_at = verifier.cache.entries[token]
+    assert expires_at - time.monotonic() <= 1
@@ -3,10 +3,14 @@ import json
 from src.main import app
 from typing import Optional, List, Union
 from httpx import AsyncClient
+from src.database_io import database_connection as mongo_init
 from src.database_io.database_connection import (
     get_database_connection,
+    DATABASE_CIRCUIT_BREAKER,
     ECOMMERCE_DATABASE_NAME)
+from src.database_io.order_statistics import rebuild_order_stats
 from bson.objectid import ObjectId
+from bson.timestamp import Timestamp
 from src.api.api_v1.endpoints.models.model_enums import OrderStatus
 
 
@@ -55,10 +59,111 @@ class TestOrdersEndpoints:
                 f'/api/v1/orders/update-order-status',
                 json=update_input)
             assert response.status_code == 200
+            response_content = json.loads(response.content)
+            assert response_content['orderStatus'] == OrderStatus.DISPATCHED
         updated_order = await self.get_order_by_id(insert_order)
         assert updated_order["status"] == OrderStatus.DISPATCHED
 
-    @pytest.mark.skip
+    @pytest.mark.unit
+    async def test_update_order_status_returns_error_if_not_found(self, insert_order: ObjectId):
+        """Test endpoint update-order-status returns 404 for an order that does
+        not exist and 422 for an invalid order id."""
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.put(
+                f'/api/v1/orders/update-order-status',
+                json={"order_id": str(insert_order)[::-1],
+                      "status": OrderStatus.DISPATCHED})
+            assert response.status_code == 404
+            assert json.loads(response.content)['detail'] == "Order not found"
+            response = await ac.put(
+                f'/api/v1/orders/update-order-status',
+                json={"order_id": "Picachu", "status": OrderStatus.DISPATCHED})
+            assert response.status_code == 422
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize('method,path,kwargs', [
+        ('PUT', '/api/v1/orders/update-order-status',
+         {'json': {'status': OrderStatus.DISPATCHED}}),
+        ('GET', '/api/v1/orders/get-order-status/{order_id}',
+         {'headers': {'X-Read-After': '1.1'}}),
+    ])
+    async def test_half_open_circuit_breaker_lets_order_request_through(self,
+                                                                       insert_order: ObjectId,
+                                                                       method,
+                                                                       path,
+                                                                       kwargs):
+        """Test the half open trial request is let through on all its
+        database calls and closes the circuit (these routes get the database
+        more than once)."""
+        if 'json' in kwargs:
+            kwargs = {'json': {**kwargs['json'], 'order_id': str(insert_order)}}
+        try:
+            for _ in range(DATABASE_CIRCUIT_BREAKER.failure_threshold):
+                DATABASE_CIRCUIT_BREAKER.record_failure()
+            DATABASE_CIRCUIT_BREAKER.opened_at -= DATABASE_CIRCUIT_BREAKER.reset_timeout
+            async with AsyncClient(app=app, base_url="http://test") as ac:
+                response = await ac.request(method,
+                                            path.format(order_id=str(insert_order)),
+                                            **kwargs)
+            assert response.status_code == 200
+            assert not DATABASE_CIRCUIT_BREAKER.is_open
+        finally:
+            DATABASE_CIRCUIT_BREAKER.record_success()
+
+    @pytest.mark.unit
+    async def test_get_order_status_reads_own_write(self, insert_order: ObjectId):
+        """Test get-order-status returns the status just updated when called
+        with the X-Read-After header returned by update-order-status (the
+        header is only returned when running against a replica set)."""
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.put(
+                f'/api/v1/orders/update-order-status',
+                json={"order_id": str(insert_order),
+                      "status": OrderStatus.CANCELLED})
+            headers = {}
+            if 'X-Read-After' in response.headers:
+                headers['X-Read-After'] = response.headers['X-Read-After']
+            response = await ac.get(
+                f'/api/v1/orders/get-order-status/{str(insert_order)}',
+                headers=headers)
+            response_content = json.loads(response.content)
+            assert response_content['orderStatus'] == OrderStatus.CANCELLED
+
+    @pytest.mark.unit
+    async def test_get_order_status_waits_for_read_after_operation_time(self, mocker):
+        """Test get-order-status reads on a causal session advanced to the
+        X-Read-After operation time (mocked, a standalone server does not
+        return operation times)."""
+        session = mocker.MagicMock()
+        session.__aenter__.return_value = session
+        client = mocker.MagicMock()
+        client.start_session = mocker.AsyncMock(return_value=session)
+        db = mocker.MagicMock()
+        db.orders.find_one = mocker.AsyncMock(return_value={'status': OrderStatus.CANCELLED})
+        mocker.patch('src.api.api_v1.endpoints.orders.get_database_connection',
+                     return_value=client)
+        mocker.patch('src.api.api_v1.endpoints.orders.get_database', return_value=db)
+        order_id = str(ObjectId())
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get(f'/api/v1/orders/get-order-status/{order_id}',
+                                    headers={'X-Read-After': '1700000000.7'})
+        assert response.status_code == 200
+        assert json.loads(response.content)['orderStatus'] == OrderStatus.CANCELLED
+        client.start_session.assert_awaited_once_with(causal_consistency=True)
+        session.advance_operation_time.assert_called_once_with(Timestamp(1700000000, 7))
+        assert db.orders.find_one.call_args.kwargs['session'] is session
+
+    @pytest.mark.unit
+    async def test_get_order_status_returns_error_if_invalid_read_after(
+            self,
+            insert_order: ObjectId):
+        """Test get-order-status returns 400 when X-Read-After is not valid"""
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get(
+                f'/api/v1/orders/get-order-status/{str(insert_order)}',
+                headers={'X-Read-After': 'Picachu'})
+            assert response.status_code == 400
+
     @pytest.mark.unit
     async def test_create_order_saves_order_when_correct_input(self,
                                                                set_products_data,
@@ -78,3 +183,140 @@ class TestOrdersEndpoints:
             response_content = json.loads(response.content)
             created_order = await self.get_order_by_id(response_content["order_id"])
             assert created_order is not None
+            assert created_order["status"] == OrderStatus.REQUESTING
+            assert [{"product_id": line["product_id"], "amount": line["amount"]}
+                    for line in created_order["products"]] == order_input["products"]
+
+    @pytest.mark.unit
+    async def test_create_order_saves_order_totals(self, set_products_data, address):
+        """Test endpoint create-order saves the order totals in cents, test
+        address is on the UK (20% tax)."""
+        order_input = {
+            "user_id": 'Mario',
+            "products": [{"product_id": product['product_id'], "amount": 2}
+                         for product in set_products_data[0:2]],
+            "delivery_address": address
+        }
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(f'/api/v1/orders/create-order',
+                                     json=order_input)
+            assert response.status_code == 201
+            response_content = json.loads(response.content)
+        created_order = await self.get_order_by_id(response_content["order_id"])
+        # 2 * 50.95 + 2 * 500.00 = 1101.90, tax = 220.38
+        assert [line["line_total_cents"] for line in created_order["products"]] == [10190, 100000]
+        assert created_order["totals"] == {"subtotal_cents": 110190,
+                                           "discount_cents": 0,
+                                           "tax_cents": 22038,
+                                           "total_cents": 132228}
+
+    @pytest.mark.unit
+    async def test_create_order_saves_order_and_stats_on_one_transaction(self,
+                                                                         mocker,
+                                                                         set_products_data,
+                                                                         address):
+        """Test create-order inserts the order and updates the order stats on
+        the same transaction (mocked, transactions need a replica set)."""
+        session = mocker.MagicMock()
+        session.__aenter__.return_value = session
+
+        async def with_transaction(callback, **kwargs):
+            return await callback(session)
+
+        session.with_transaction = mocker.AsyncMock(side_effect=with_transaction)
+        db = mocker.MagicMock()
+        db.products.find.return_value.to_list = mocker.AsyncMock(
+            return_value=set_products_data[0:1])
+        db.orders.insert_one = mocker.AsyncMock(
+            return_value=mocker.MagicMock(inserted_id=ObjectId()))
+        order_stats = db.__getitem__.return_value
+        order_stats.bulk_write = mocker.AsyncMock()
+        client = mocker.MagicMock()
+        client.__getitem__.return_value = db
+        client.start_session = mocker.AsyncMock(return_value=session)
+        mocker.patch('src.api.api_v1.endpoints.orders.get_database_connection',
+                     return_value=client)
+        order_input = {
+            "user_id": 'Mario',
+            "products": [{"product_id": set_products_data[0]['product_id'],
+                          "amount": 1}],
+            "delivery_address": address
+        }
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(f'/api/v1/orders/create-order',
+                                     json=order_input)
+        assert response.status_code == 201
+        session.with_transaction.assert_awaited_once()
+        assert db.orders.insert_one.call_args.kwargs['session'] is session
+        assert order_stats.bulk_write.call_args.kwargs['session'] is session
+
+    @pytest.mark.unit
+    async def test_create_order_returns_error_if_product_not_found(self,
+                                                                   set_products_data,
+                                                                   address):
+        """Test endpoint create-order rejects orders with unknown products."""
+        order_input = {
+            "user_id": 'Mario',
+            "products": [{"product_id": set_products_data[0]['product_id'],
+                          "amount": 1},
+                         {"product_id": "Picachu", "amount": 1}],
+            "delivery_address": address
+        }
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(f'/api/v1/orders/create-order',
+                                     json=order_input)
+            assert response.status_code == 422
+            assert 'Picachu' in json.loads(response.content)['detail']
+
+    @pytest.mark.unit
+    async def test_order_stats_counts_created_and_updated_orders(self,
+                                                                 set_products_data,
+                                                                 address):
+        """Test endpoint order-stats returns the orders count by status after
+        creating orders and updating the status of one of them."""
+        order_input = {
+            "user_id": 'Mario',
+            "products": [{"product_id": set_products_data[0]['product_id'],
+                          "amount": 1}],
+            "delivery_address": address
+        }
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            order_ids = []
+            for _ in range(2):
+                response = await ac.post(f'/api/v1/orders/create-order',
+                                         json=order_input)
+                order_ids.append(json.loads(response.content)["order_id"])
+            await ac.put(f'/api/v1/orders/update-order-status',
+                         json={"order_id": order_ids[0],
+                               "status": OrderStatus.ACCEPTED})
+            response = await ac.get(f'/api/v1/orders/order-stats')
+            assert response.status_code == 200
+            response_content = json.loads(response.content)
+            assert response_content['total'] == 2
+            assert response_content['by_status'] == {OrderStatus.REQUESTING: 1,
+                                                     OrderStatus.ACCEPTED: 1}
+            created_order = await self.get_order_by_id(order_ids[0])
+            day = created_order['created_at'].date().isoformat()
+            response = await ac.get(f'/api/v1/orders/order-stats?day={day}')
+            assert json.loads(response.content)['total'] == 2
+
+    @pytest.mark.unit
+    async def test_order_stats_count_existing_orders_after_rebuild(self, address):
+        """Test the order stats rebuilt from the orders collection count the
+        orders saved before the stats were kept, so their status changes
+        don't leave negative counts."""
+        db = mongo_init.SYNC_MONGO_CONNECTION[ECOMMERCE_DATABASE_NAME]
+        order_id = db.orders.insert_one({"user_id": 'mario',
+                                         "products": [],
+                                         "delivery_address": address,
+                                         "status": OrderStatus.ACCEPTED.value}).inserted_id
+        assert rebuild_order_stats(db) == 2
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            await ac.put(f'/api/v1/orders/update-order-status',
+                         json={"order_id": str(order_id),
+                               "status": OrderStatus.DISPATCHED})
+            response = await ac.get(f'/api/v1/orders/order-stats')
+        response_content = json.loads(response.content)
+        assert response_content['total'] == 1
+        assert response_content['by_status'] == {OrderStatus.ACCEPTED: 0,
+                                                 OrderStatus.DISPATCHED: 1}
@@ -0,0 +1,160 @@
+import logging
+
+import pytest
+from bson.objectid import ObjectId
+from httpx import AsyncClient
+from src.main import app
+from src.database_io.database_connection import (
+    get_background_database,
+    get_database,
+    DATABASE_CIRCUIT_BREAKER)
+from src.database_io.outbox import (
+    build_order_event,
+    InMemoryEventSink,
+    OutboxDispatcher,
+    ORDER_STATUS_CHANGED,
+    OUTBOX_FIELD)
+from src.api.api_v1.endpoints.models.model_enums import OrderStatus
+
+
+class FailingEventSink(InMemoryEventSink):
+    async def deliver(self, events):
+        raise ConnectionError('sink down')
+
+
+class PoisonEventSink(InMemoryEventSink):
+    """Sink failing on the events of one order."""
+
+    def __init__(self, poison_order_id: ObjectId):
+        super().__init__()
+        self.poison_order_id = str(poison_order_id)
+
+    async def deliver(self, events):
+        if any(event['order_id'] == self.poison_order_id for event in events):
+            raise ValueError('poison event')
+        await super().deliver(events)
+
+
+async def insert_orders_with_events(count: int):
+    """Insert orders with one pending event each, return their ids"""
+    result = await get_database().orders.insert_many(
+        [{'user_id': 'mario',
+          'status': OrderStatus.REQUESTING.value,
+          OUTBOX_FIELD: [build_order_event(ORDER_STATUS_CHANGED, {'status': 'REQUESTING'})]}
+         for _ in range(count)])
+    return result.inserted_ids
+
+
+async def expire_leases():
+    await get_database().orders.update_many({}, {'$unset': {'outbox_lease_until': ''}})
+
+
+async def drain(dispatcher: OutboxDispatcher, times: int):
+    """Drain the outbox 'times' times ignoring the sink errors"""
+    for _ in range(times):
+        try:
+            await dispatcher.drain_once()
+        except Exception:
+            pass
+
+
+async def update_order_status(order_id: ObjectId, order_status: OrderStatus):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.put(f'/api/v1/orders/update-order-status',
+                                json={"order_id": str(order_id),
+                                      "status": order_status})
+        assert response.status_code == 200
+
+
+@pytest.mark.unit
+async def test_dispatcher_delivers_order_events_and_removes_them(insert_order):
+    """Test the status change event is saved with the order, delivered by the
+    dispatcher and then removed from the order."""
+    await update_order_status(insert_order, OrderStatus.DISPATCHED)
+    db = get_database()
+    order = await db.orders.find_one({"_id": insert_order})
+    assert len(order[OUTBOX_FIELD]) == 1
+
+    sink = InMemoryEventSink()
+    dispatcher = OutboxDispatcher(get_database, sink)
+    assert await dispatcher.drain_once() == 1
+    assert [(event['type'], event['order_id'], event['payload']['status'])
+            for event in sink.events] == [(ORDER_STATUS_CHANGED,
+                                           str(insert_order),
+                                           OrderStatus.DISPATCHED)]
+    order = await db.orders.find_one({"_id": insert_order})
+    assert order[OUTBOX_FIELD] == []
+    assert await dispatcher.drain_once() == 0
+
+
+@pytest.mark.unit
+async def test_dispatcher_keeps_events_when_delivery_fails(insert_order):
+    """Test events are kept on the order when the sink fails and delivered on
+    the next attempt (at-least-once)."""
+    await update_order_status(insert_order, OrderStatus.CANCELLED)
+    with pytest.raises(ConnectionError):
+        await OutboxDispatcher(get_database, FailingEventSink()).drain_once()
+    order = await get_database().orders.find_one({"_id": insert_order})
+    assert len(order[OUTBOX_FIELD]) == 1
+    await expire_leases()
+
+    sink = InMemoryEventSink()
+    assert await OutboxDispatcher(get_database, sink).drain_once() == 1
+    assert len(sink.events) == 1
+
+
+@pytest.mark.unit
+async def test_dispatcher_does_not_use_the_api_circuit_breaker(insert_order):
+    """Test the dispatcher drains while the API breaker is open and leaves the
+    breaker as it was, so it can't take the API half open trial call."""
+    await update_order_status(insert_order, OrderStatus.DISPATCHED)
+    for _ in range(DATABASE_CIRCUIT_BREAKER.failure_threshold):
+        DATABASE_CIRCUIT_BREAKER.record_failure()
+    opened_at = DATABASE_CIRCUIT_BREAKER.opened_at
+    try:
+        sink = InMemoryEventSink()
+        assert await OutboxDispatcher(get_background_database, sink).drain_once() == 1
+        assert len(sink.events) == 1
+        assert DATABASE_CIRCUIT_BREAKER.opened_at == opened_at
+    finally:
+        DATABASE_CIRCUIT_BREAKER.record_success()
+
+
+@pytest.mark.unit
+async def test_dispatcher_sink_outage_does_not_count_attempts():
+    """Test a sink outage does not count attempts on the orders, so it can't
+    turn their events into dead letters."""
+    order_ids = await insert_orders_with_events(3)
+    dispatcher = OutboxDispatcher(get_database, FailingEventSink(), max_attempts=1)
+    for _ in range(3):
+        await drain(dispatcher, 5)
+        await expire_leases()
+    assert await get_database().orders.count_documents(
+        {'outbox_attempts': {'$exists': True}}) == 0
+    sink = InMemoryEventSink()
+    assert await OutboxDispatcher(get_database, sink).drain_once() == 3
+    assert {event['order_id'] for event in sink.events} == {str(order_id)
+                                                           for order_id in order_ids}
+
+
+@pytest.mark.unit
+async def test_dispatcher_dead_letters_failing_order_and_requeues_it(caplog):
+    """Test the order whose events fail on their own is isolated from its
+    batch, left as dead letter after max_attempts, logged, and delivered
+    once requeued."""
+    first_id, second_id, poison_id = await insert_orders_with_events(3)
+    sink = PoisonEventSink(poison_id)
+    dispatcher = OutboxDispatcher(get_database, sink, max_attempts=1)
+    with caplog.at_level(logging.ERROR, logger='src.database_io.outbox'):
+        await drain(dispatcher, 4)
+    assert [event['order_id'] for event in sink.events] == [str(first_id), str(second_id)]
+    poison_order = await get_database().orders.find_one({'_id': poison_id})
+    assert poison_order['outbox_attempts'] == 1
+    assert str(poison_id) in caplog.text
+    await expire_leases()
+    assert await dispatcher.drain_once() == 0
+
+    assert await dispatcher.requeue_dead_letters() == 1
+    sink = InMemoryEventSink()
+    assert await OutboxDispatcher(get_database, sink).drain_once() == 1
+    assert [event['order_id'] for event in sink.events] == [str(poison_id)]
@@ -0,0 +1,68 @@
+import random
+import pytest
+from decimal import Decimal
+from src.api.api_v1.endpoints.models.input_models import OrderProduct
+from src.api.api_v1.endpoints.models.model_enums import AllowedCountries
+from src.pricing import (
+    price_order,
+    price_orders_batch,
+    to_cents,
+    to_fixed_point,
+    BASIS_POINT,
+    CENT)
+
+
+@pytest.mark.unit
+def test_order_product_total_applies_discount():
+    """Test OrderProduct.total is price * quantity minus the discount, rounded
+    half up to cents."""
+    assert OrderProduct(product_id='p', quantity=3, price=10.15).total() == Decimal('30.45')
+    # 30.45 * 0.15 = 4.5675 -> 4.57 discount
+    assert OrderProduct(product_id='p', quantity=3, price=10.15,
+                        discount=0.15).total() == Decimal('25.88')
+
+
+@pytest.mark.unit
+def test_price_order_applies_country_tax():
+    """Test the tax rate depends on the delivery country"""
+    lines = [(50.95, 2, None), (10.15, 1, 0.1)]
+    uk_totals = price_order(lines, AllowedCountries.UK)
+    assert uk_totals.to_dict() == {'subtotal': Decimal('112.05'),
+                                   'discount': Decimal('1.02'),
+                                   'tax': Decimal('22.21'),
+                                   'total': Decimal('133.24')}
+    germany_totals = price_order(lines, AllowedCountries.GERMANY)
+    assert germany_totals.tax == Decimal('21.10')
+
+
+@pytest.mark.unit
+def test_to_fixed_point_rounds_half_up_like_decimal():
+    """Test batch rounding is half up on the decimal value, 1.005 is
+    1.00499999... in binary and 0.125 is a tie for round half to even."""
+    assert list(to_fixed_point([0.125, 1.005, 2.675, 50.95], CENT)) == [13, 101, 268, 5095]
+    assert list(to_fixed_point([0.00005, 0.12345, 0.3333], BASIS_POINT)) == [1, 1235, 3333]
+
+
+@pytest.mark.unit
+def test_price_orders_batch_matches_single_order_path():
+    """Test the vectorized batch totals are exactly the Decimal ones"""
+    rng = random.Random(3)
+    orders = [([(round(rng.uniform(0.01, 999), rng.choice([2, 3])),
+                 rng.randint(1, 5),
+                 rng.choice([0, 0.1, 0.125, 0.3333, 0.00005]))
+                for _ in range(rng.randint(1, 6))],
+               rng.choice(list(AllowedCountries)))
+              for _ in range(500)]
+    prices, quantities, discounts, order_index = [], [], [], []
+    for index, (lines, _) in enumerate(orders):
+        for price, quantity, discount in lines:
+            prices.append(price)
+            quantities.append(quantity)
+            discounts.append(discount)
+            order_index.append(index)
+    batch_totals = price_orders_batch(prices, quantities, discounts, order_index,
+                                      [country for _, country in orders])
+    for index, (lines, country) in enumerate(orders):
+        totals = price_order(lines, country)
+        assert {name: int(values[index]) for name, values in batch_totals.items()} == \
+            {name: to_cents(value) for name, value in totals.to_dict().items()}
@@ -3,11 +3,22 @@ import random
 import pytest
 from src.main import app
 from httpx import AsyncClient
+from src.api.api_v1.endpoints.products import AVAILABILITY_CACHE
 from src.database_io.database_connection import (
     get_database_connection,
+    DATABASE_CIRCUIT_BREAKER,
     ECOMMERCE_DATABASE_NAME)
 
 
+@pytest.fixture(autouse=True)
+def empty_availability_cache():
+    """The availability cache is module level, empty it so tests don't see
+    the products cached by previous tests."""
+    AVAILABILITY_CACHE.clear()
+    yield
+    AVAILABILITY_CACHE.clear()
+
+
 async def find_product_by_id(product_id):
     database_client = get_database_connection()
     db = database_client[ECOMMERCE_DATABASE_NAME]
@@ -63,4 +74,27 @@ async def test_endpoint_discount_product_count(set_products_data):
         response = await ac.put(f'/api/v1/products/discount-product-count/{product_id}?count={1}')
     assert response.status_code == 200
     updated_product = await find_product_by_id(product_id)
-    assert updated_product['available_count'] == product_available_count - 1
\ No newline at end of file
+    assert updated_product['available_count'] == product_available_count - 1
+
+@pytest.mark.unit
+async def test_endpoint_available_product_uses_cache_when_database_unavailable(
+        set_products_data):
+    """Test endpoint available-product answers from the last known available
+    count while the database circuit breaker is open, and returns 503 for
+    products it never saw."""
+    saved_product = set_products_data[0]
+    product_id = saved_product['product_id']
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get(f'/api/v1/products/available-product/{product_id}?count=1')
+        assert response.status_code == 200
+        for _ in range(DATABASE_CIRCUIT_BREAKER.failure_threshold):
+            DATABASE_CIRCUIT_BREAKER.record_failure()
+        assert DATABASE_CIRCUIT_BREAKER.is_open
+        try:
+            response = await ac.get(f'/api/v1/products/available-product/{product_id}?count=1')
+            assert response.status_code == 200
+            assert json.loads(response.content)['is_available'] is True
+            response = await ac.get(f'/api/v1/products/available-product/{set_products_data[1]["product_id"]}?count=1')
+            assert response.status_code == 503
+        finally:
+            DATABASE_CIRCUIT_BREAKER.record_success()
@@ -0,0 +1,154 @@
+import asyncio
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from src.api.rate_limiting import (
+    get_client_id,
+    ConcurrencyLimitMiddleware,
+    InMemoryBucketStore,
+    RateLimit,
+    RateLimitMiddleware)
+
+
+def build_app(**middleware_options) -> FastAPI:
+    """Build a small app with the rate limit middleware"""
+    test_app = FastAPI()
+
+    @test_app.get('/limited')
+    async def limited():
+        return {'message': 'ok'}
+
+    @test_app.get('/free')
+    async def free():
+        return {'message': 'ok'}
+
+    @test_app.get('/health')
+    async def health():
+        return {'message': 'ok'}
+
+    test_app.add_middleware(RateLimitMiddleware, **middleware_options)
+    return test_app
+
+
+@pytest.mark.unit
+def test_bucket_store_refills_with_time():
+    """Test the bucket allows 'burst' requests at once and then refills at
+    'rate' tokens per second."""
+    store = InMemoryBucketStore()
+    limit = RateLimit(rate=2, burst=3)
+    assert [store.consume('client', limit, now=0) for _ in range(3)] == [0, 0, 0]
+    assert store.consume('client', limit, now=0) == pytest.approx(0.5)
+    assert store.consume('client', limit, now=0.5) == 0
+    assert store.consume('other-client', limit, now=0.5) == 0
+
+
+@pytest.mark.unit
+def test_bucket_store_drops_least_recently_used_bucket():
+    """Test the store never keeps more than max_buckets buckets"""
+    store = InMemoryBucketStore(max_buckets=2)
+    limit = RateLimit(rate=1, burst=1)
+    store.consume('mario', limit, now=0)
+    store.consume('luigi', limit, now=0)
+    assert store.consume('mario', limit, now=0) > 0
+    store.consume('peach', limit, now=0)
+    assert list(store.buckets) == ['mario', 'peach']
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('client, forwarded_for, expected', [
+    ('10.0.0.1', b'1.1.1.1', '10.0.0.1'),
+    ('10.0.0.9', b'1.1.1.1', '1.1.1.1'),
+    ('10.0.0.9', b'6.6.6.6, 1.1.1.1', '1.1.1.1'),
+    ('10.0.0.9', b'6.6.6.6, 1.1.1.1, 10.0.0.8', '1.1.1.1'),
+    ('10.0.0.9', None, '10.0.0.9'),
+])
+def test_get_client_id_only_trusts_forwarded_for_from_proxies(client,
+                                                              forwarded_for,
+                                                              expected):
+    """Test X-Forwarded-For is ignored unless the request comes from one of
+    our proxies, and then the client is the last address not added by them."""
+    headers = [] if forwarded_for is None else [(b'x-forwarded-for', forwarded_for)]
+    scope = {'client': (client, 1234), 'headers': headers}
+    assert get_client_id(scope, trusted_proxies={'10.0.0.8', '10.0.0.9'}) == expected
+
+
+@pytest.mark.unit
+async def test_rate_limit_middleware_returns_429_per_route():
+    """Test requests over the route limit get 429 while other routes still
+    answer."""
+    test_app = build_app(default_limit=RateLimit(rate=1000, burst=1000),
+                         route_limits={'/limited': RateLimit(rate=0.01, burst=2)})
+    async with AsyncClient(app=test_app, base_url="http://test") as ac:
+        responses = [await ac.get('/limited') for _ in range(3)]
+        assert [response.status_code for response in responses] == [200, 200, 429]
+        assert 'retry-after' in responses[-1].headers
+        response = await ac.get('/free')
+        assert response.status_code == 200
+
+
+@pytest.mark.unit
+async def test_rate_limit_middleware_skips_health_check():
+    """Test the health check answers when the client is over the limit"""
+    test_app = build_app(default_limit=RateLimit(rate=0.01, burst=1))
+    async with AsyncClient(app=test_app, base_url="http://test") as ac:
+        response = await ac.get('/free')
+        assert response.status_code == 200
+        response = await ac.get('/free')
+        assert response.status_code == 429
+        for _ in range(3):
+            response = await ac.get('/health')
+            assert response.status_code == 200
+
+
+@pytest.mark.unit
+async def test_rate_limit_middleware_limits_per_client():
+    """Test a client over the limit does not affect other clients"""
+    # the test client connects from 127.0.0.1, acting as our proxy.
+    test_app = build_app(route_limits={'/limited': RateLimit(rate=0.01, burst=1)},
+                         trusted_proxies={'127.0.0.1'})
+    async with AsyncClient(app=test_app, base_url="http://test") as ac:
+        response = await ac.get('/limited', headers={'X-Forwarded-For': 'mario'})
+        assert response.status_code == 200
+        response = await ac.get('/limited', headers={'X-Forwarded-For': 'mario'})
+        assert response.status_code == 429
+        response = await ac.get('/limited', headers={'X-Forwarded-For': 'luigi'})
+        assert response.status_code == 200
+
+
+@pytest.mark.unit
+async def test_rate_limit_middleware_ignores_forwarded_for_from_clients():
+    """Test a client can't get a new bucket by changing X-Forwarded-For"""
+    test_app = build_app(route_limits={'/limited': RateLimit(rate=0.01, burst=1)},
+                         trusted_proxies=set())
+    async with AsyncClient(app=test_app, base_url="http://test") as ac:
+        response = await ac.get('/limited', headers={'X-Forwarded-For': 'mario'})
+        assert response.status_code == 200
+        response = await ac.get('/limited', headers={'X-Forwarded-For': 'luigi'})
+        assert response.status_code == 429
+
+
+@pytest.mark.unit
+async def test_concurrency_limit_middleware_sheds_load():
+    """Test requests over the in flight limit get 503"""
+    test_app = FastAPI()
+    release = asyncio.Event()
+
+    @test_app.get('/slow')
+    async def slow():
+        await release.wait()
+        return {'message': 'ok'}
+
+    @test_app.get('/health')
+    async def health():
+        return {'message': 'ok'}
+
+    test_app.add_middleware(ConcurrencyLimitMiddleware, max_in_flight=1)
+    async with AsyncClient(app=test_app, base_url="http://test") as ac:
+        first_request = asyncio.ensure_future(ac.get('/slow'))
+        await asyncio.sleep(0.05)
+        response = await ac.get('/slow')
+        assert response.status_code == 503
+        response = await ac.get('/health')
+        assert response.status_code == 200
+        release.set()
+        assert (await first_request).status_code == 200
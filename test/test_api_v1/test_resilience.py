@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+from src.database_io import database_connection
+from src.database_io.database_connection import run_in_transaction
+from src.database_io.resilience import (
+    reset_request_admissions,
+    reset_request_deadline,
+    set_request_deadline,
+    start_request_admissions,
+    CircuitBreaker,
+    DatabaseUnavailable,
+    DeadlineExceeded)
+
+
+async def failing_call():
+    raise ServerSelectionTimeoutError('No servers found')
+
+
+@pytest.mark.unit
+async def test_circuit_breaker_opens_after_consecutive_failures():
+    """Test the breaker stops letting calls through after failure_threshold
+    failures and lets a trial call through after reset_timeout."""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    for _ in range(2):
+        assert breaker.allow_request()
+        with pytest.raises(DatabaseUnavailable):
+            await breaker.call(failing_call())
+    assert not breaker.allow_request()
+    await asyncio.sleep(0.05)
+    assert breaker.allow_request()
+    assert await breaker.call(asyncio.sleep(0, result='ok')) == 'ok'
+    assert not breaker.is_open
+
+
+@pytest.mark.unit
+async def test_circuit_breaker_checks_once_per_request():
+    """Test a request let through by the half open breaker is let through
+    again, while other requests wait for the trial result."""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    await asyncio.sleep(0.05)
+    token = start_request_admissions()
+    try:
+        assert breaker.allow_current_request()
+        assert breaker.allow_current_request()
+    finally:
+        reset_request_admissions(token)
+    token = start_request_admissions()
+    try:
+        assert not breaker.allow_current_request()
+    finally:
+        reset_request_admissions(token)
+
+
+@pytest.mark.unit
+async def test_circuit_breaker_call_enforces_request_deadline():
+    """Test a call slower than the request deadline raises DeadlineExceeded"""
+    breaker = CircuitBreaker(failure_threshold=1)
+    token = set_request_deadline(0.01)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            await breaker.call(asyncio.sleep(1))
+        assert breaker.is_open
+    finally:
+        reset_request_deadline(token)
+
+
+@pytest.mark.unit
+async def test_run_in_transaction_without_transaction_support(mocker):
+    """Test the writes run without a transaction when the server does not
+    support transactions (standalone mongod), and the transaction is not
+    tried again."""
+    mocker.patch.object(database_connection, 'TRANSACTIONS_SUPPORTED', True)
+    session = mocker.MagicMock()
+    session.with_transaction = mocker.AsyncMock(side_effect=OperationFailure(
+        'Transaction numbers are only allowed on a replica set member or mongos',
+        code=20))
+    callback = mocker.AsyncMock(return_value='saved')
+    assert await run_in_transaction(session, callback) == 'saved'
+    assert await run_in_transaction(session, callback) == 'saved'
+    session.with_transaction.assert_awaited_once()
+    callback.assert_awaited_with(session)
+    assert not database_connection.TRANSACTIONS_SUPPORTED
+
+
+@pytest.mark.unit
+async def test_run_in_transaction_raises_other_errors(mocker):
+    """Test other operation failures are not taken as no transaction support"""
+    mocker.patch.object(database_connection, 'TRANSACTIONS_SUPPORTED', True)
+    session = mocker.MagicMock()
+    session.with_transaction = mocker.AsyncMock(side_effect=OperationFailure(
+        'Document failed validation', code=121))
+    callback = mocker.AsyncMock()
+    with pytest.raises(OperationFailure):
+        await run_in_transaction(session, callback)
+    callback.assert_not_awaited()
+    assert database_connection.TRANSACTIONS_SUPPORTED
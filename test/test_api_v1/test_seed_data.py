@@ -0,0 +1,54 @@
+import json
+import pytest
+from collections import Counter
+from httpx import AsyncClient
+from src.main import app
+from src.database_io.seed_data import (
+    generate_orders,
+    generate_products,
+    SeedConfig)
+
+
+def generate(config: SeedConfig):
+    products_by_id = {product['product_id']: product
+                      for product in generate_products(config)}
+    return list(products_by_id), list(generate_orders(config, products_by_id))
+
+
+@pytest.mark.unit
+def test_seed_data_is_deterministic():
+    """Test the same seed generates the same data and another seed does not"""
+    config = SeedConfig(products=100, users=20)
+    assert generate(config) == generate(config)
+    assert generate(config) != generate(SeedConfig(products=100, users=20, seed=7))
+
+
+@pytest.mark.unit
+def test_seed_data_products_popularity_is_skewed():
+    """Test the first (hot) products are in many more orders than the tail"""
+    product_ids, orders = generate(SeedConfig(products=1000, users=200))
+    product_count = Counter(line['product_id']
+                            for order in orders for line in order['products'])
+    assert product_count[product_ids[0]] > 10 * product_count[product_ids[500]]
+
+
+@pytest.mark.unit
+def test_seed_data_orders_are_priced():
+    """Test the generated orders have their lines and totals priced"""
+    _, orders = generate(SeedConfig(products=100, users=20))
+    for order in orders:
+        totals = order['totals']
+        assert totals['subtotal_cents'] == sum(line['line_total_cents']
+                                               for line in order['products'])
+        assert totals['total_cents'] == totals['subtotal_cents'] + totals['tax_cents']
+
+
+@pytest.mark.unit
+async def test_seed_data_order_stats_match_orders(large_dataset):
+    """Test the loaded order_stats documents count all the loaded orders"""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/api/v1/orders/order-stats')
+    assert response.status_code == 200
+    response_content = json.loads(response.content)
+    assert response_content['total'] == large_dataset['orders']
+    assert sum(response_content['by_status'].values()) == large_dataset['orders']
@@ -0,0 +1,72 @@
+import json
+import pytest
+from src.main import app
+from httpx import AsyncClient
+from src.api import auth
+from src.api.auth import create_access_token
+from src.api.api_v1.endpoints.models.model_enums import OrderStatus
+from src.database_io import database_connection as mongo_init
+
+
+@pytest.fixture()
+async def users():
+    """Save the users Mario and Peach on database, Peach has no user id"""
+    auth.USER_CACHE.clear()
+    db = mongo_init.MONGO_CONNECTION[mongo_init.ECOMMERCE_DATABASE_NAME]
+    await db.users.insert_many([{'username': 'mario', 'user_id': 'Mario'},
+                                {'username': 'peach'}])
+
+
+def bearer(username: str):
+    return {'Authorization': f'Bearer {create_access_token(username)}'}
+
+
+@pytest.mark.unit
+async def test_endpoint_user_info_returns_user_orders_count(users,
+                                                            set_products_data,
+                                                            address):
+    """Test endpoint user-info returns the orders count of the token user only."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for user_id in ['Mario', 'Mario', 'Luigi']:
+            order_input = {
+                "user_id": user_id,
+                "products": [{"product_id": set_products_data[0]['product_id'],
+                              "amount": 1}],
+                "delivery_address": address
+            }
+            response = await ac.post(f'/api/v1/orders/create-order',
+                                     json=order_input)
+            assert response.status_code == 201
+        response = await ac.get(f'/api/v1/users/user-info?user_id=Luigi',
+                                headers=bearer('mario'))
+    assert response.status_code == 200
+    response_content = json.loads(response.content)
+    assert response_content['user_id'] == 'Mario'
+    assert response_content['orders']['total'] == 2
+    assert response_content['orders']['by_status'] == {OrderStatus.REQUESTING: 2}
+
+
+@pytest.mark.unit
+async def test_endpoint_user_info_returns_zero_when_no_orders(users):
+    """Test endpoint user-info returns empty counts for a user without orders"""
+    db = mongo_init.MONGO_CONNECTION[mongo_init.ECOMMERCE_DATABASE_NAME]
+    await db.users.insert_one({'username': 'toad', 'user_id': 'Toad'})
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get(f'/api/v1/users/user-info', headers=bearer('toad'))
+    assert response.status_code == 200
+    response_content = json.loads(response.content)
+    assert response_content['orders'] == {'total': 0, 'by_status': {}}
+
+
+@pytest.mark.unit
+async def test_endpoint_user_info_requires_authentication(users):
+    """Test endpoint user-info returns 401 without a valid token and 404 for
+    a user without user id"""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get(f'/api/v1/users/user-info?user_id=Mario')
+        assert response.status_code == 401
+        response = await ac.get(f'/api/v1/users/user-info',
+                                headers={'Authorization': 'Bearer not-a-token'})
+        assert response.status_code == 401
+        response = await ac.get(f'/api/v1/users/user-info', headers=bearer('peach'))
+        assert response.status_code == 404